@@ -1,22 +1,155 @@
 import os
 import sys
 import re
+import json
+import time
+import locale
+import functools
+import contextlib
+
+
+# PATTERNS: SHARED BY EVERY STAGE OF THE PIPELINE, EACH ONE COMPILED THE FIRST TIME IT IS USED
+class PatternRegistry(dict):
+    '''
+    Dict of compiled patterns, filled in from 'sources' only as each pattern is first looked up, so a short run such 
+    as a cache hit or the structured parser never pays to compile the patterns it does not use.
+    '''
+
+    def __init__(self, sources):
+        super().__init__()
+        self.sources = sources
+
+    def __missing__(self, name):
+        pattern = self[name] = re.compile(self.sources[name])
+        return pattern
+
+    def compile_all(self):
+        '''Returns every pattern by name, compiling any that have not been used yet.'''
+
+        return {name: self[name] for name in self.sources}
+
+
+PATTERNS = PatternRegistry({
+    # remove_comments_and_add_header()
+    'leading_comment': r'\/\*+\/',
+    'header_row': r'0*1\s+\w+\s*,',
+    'header_name': r'\s+\w+[\s,]',
+    'digits': r'\d+',
+
+    # general_formatting()
+    'level_number': r'^\s+([1-9])',
+
+    # replace_pl1_expressions_and_add_periods()
+    'improper_pic': r"\s+PIC\s*[XS]*9*['(]\d+[')]",
+    'char': r'\sCHAR\s*\(',
+    'fixed': r'\sFIXED\s*\(',
+    'pic_s9': r'\sPIC S9\(',
+    'precision_scale': r'\d+,\d+',
+    'fixed_bin': r'\sFIXED BIN\s?\(\d+\)',
+    'pic_x': r'\sPIC X\(',
+    'pic_any': r'\sPIC.+$',
+    'occurs': r'\d+\s+\w+\(\d+\)\s+$',
+    'holdover': r'\w+[^\.]\s*$',
+    'trailing_space': r'\s+$',
+    'indented_level': r'^( +)0([1-9])',
+    'layout_entry': r'^\s+(\d{2})\s+([^\s.(]+)(?:\((\d+)\))?',
+    'field_line': r'(\s+(\d{2})\s+)([^\s]+)',
+    'hidden_occurs': r'([\w\-]+)\((\d+)\)(.*)',
+
+    # clean_up_formatting_and_increment_field_names()
+    'pic_clause': r'PIC\s.+$',
+
+    # tokenize_pl1() and build_field_records(): each alternative starts on a distinct character, so a token 
+    # is matched without backtracking
+    'pl1_token': (r"(?P<space>\s+)|(?P<comment>/\*)|(?P<number>\d+)|(?P<name>[A-Za-z_#@$][\w#@$]*)"
+                  r"|(?P<string>'[^']*(?:''[^']*)*')|(?P<punct>[(),;])|(?P<other>.)"),
+    'pl1_picture_repeat': r'\((\d+)\)(.)',
+
+    # storage_length()
+    'cobol_picture_repeat': r'(.)\((\d+)\)',
+
+    # __main__
+    'file_extension': r'\.\w{2,4}$',
+})
+
 
 
 # PIPELINE: WRAPPING UP ALL FUNCTIONS TOGETHER AND PROCESSING THE TEXT WITH THEM IN ORDER
-def complete_pipeline(pl1_filename, cbl_filename, counter_start):
+def complete_pipeline(pl1_filename, cbl_filename, counter_start, *, stream=False, fsync=False, cache_dir=None, 
+                      parser='heuristic', stats_dir=None, mapped=False, memo=None, layout=None, changes=None):
     '''
     Method that takes all the functions in order for a complete processing pipeline, including writing 
-    the output to a file of a given name passed in via 'cbl_filename' parameter.
+    the output to a file of a given name passed in via 'cbl_filename' parameter. Every option after 'counter_start' 
+    is passed by keyword.
+
+    With 'stream' set, every stage is chained as a generator instead of building a full list of lines, so each line 
+    passes through the whole pipeline and is written before the next one is read, keeping memory flat regardless of 
+    the copybook's size. With 'fsync' set, the output is flushed to disk before it replaces any existing file.
+
+    With a 'cache_dir', a copybook that was already converted from the same 'counter_start' by the same version of 
+    the converter skips every stage, and its stored .cbl output and 'counter_end' are reused instead. 'parser' 
+    selects the conversion path, as in convert_pl1_lines().
+
+    With a 'stats_dir', the run is instrumented with a PipelineStats and its per-stage timings and counters are 
+    written there as JSON, named after 'cbl_filename' (see write_json()). With 'mapped' set, the copybook is read 
+    through a memory map, as in read_open_pl1_and_cobol_files(). A GroupMemo passed in as 'memo' is shared with 
+    every other file it is passed along with, as in convert_pl1_lines().
+
+    With 'layout' set to 'json' or 'bin', the storage offset and length of every field is also written next to the 
+    .cbl file by a LayoutWriter, as each field is converted. A cache hit copies the layout stored with its output, 
+    and one stored without a layout is converted again.
+
+    Given a 'changes' dict, the .cbl file is only rewritten if its output differs from the file already there, and 
+    whether it was 'new', 'changed' or 'unchanged' is recorded in 'changes' (see write_output_to_file()).
     '''
 
-    pl1_text = read_open_pl1_and_cobol_files(pl1_filename)
-    new_pl1_text_1 = remove_comments_and_add_header(pl1_text)
-    new_pl1_text_2 = general_formatting(new_pl1_text_1)
-    new_pl1_text_3 = replace_pl1_expressions_and_add_periods(new_pl1_text_2, pl1_filename)
-    new_pl1_text_4, counter_end = clean_up_formatting_and_increment_field_names(new_pl1_text_3, counter_start)
-    final_output = write_output_to_file(new_pl1_text_4, cbl_filename)
-    if final_output != '':
+    stats = PipelineStats(pl1_filename, cbl_filename, parser) if stats_dir else None
+    memo_counters = memo.counters() if memo is not None else {}
+    start = time.perf_counter()
+
+    cache_key = generate_cache_key(pl1_filename, counter_start, parser, mapped) if cache_dir else None
+    cache_entry = read_cache_entry(cache_dir, cache_key) if cache_key else None
+    if cache_entry and layout and not copy_cached_layout(cache_dir, cache_key, cbl_filename, layout):
+        cache_entry = None # stored without this layout, so convert it again to lay it out
+    if cache_entry:
+        final_output = copy_cached_output(cache_dir, cache_key, cbl_filename, fsync, changes)
+        counter_end = cache_entry['counter_end']
+        if stats:
+            stats.cache_hit = True
+
+    else:
+        with LayoutWriter(cbl_filename, layout, pl1_filename) if layout else contextlib.nullcontext() as layout_writer:
+            if stream:
+                with stats.counting_patterns() if stats else contextlib.nullcontext():
+                    pl1_text = read_open_pl1_and_cobol_files(pl1_filename, stream=True, mapped=mapped)
+                    cobol_text, counter_state = convert_pl1_lines(pl1_text, counter_start, pl1_filename, stream=True, 
+                                                                  parser=parser, stats=stats, memo=memo, 
+                                                                  layout=layout_writer)
+                    with stats.section('write_output_to_file') if stats else contextlib.nullcontext():
+                        final_output = write_output_to_file(cobol_text, cbl_filename, stream=True, fsync=fsync, 
+                                                            changes=changes)
+                counter_end = counter_state['counter_end']
+
+            else:
+                with stats.counting_patterns() if stats else contextlib.nullcontext():
+                    pl1_text = read_open_pl1_and_cobol_files(pl1_filename, mapped=mapped)
+                    cobol_lines, counter_end, diagnostics = convert_text(pl1_text, counter_start, pl1_filename, 
+                                                                         parser=parser, stats=stats, memo=memo, 
+                                                                         layout=layout_writer)
+                    with stats.section('write_output_to_file') if stats else contextlib.nullcontext():
+                        final_output = write_output_to_file(cobol_lines, cbl_filename, fsync=fsync, changes=changes)
+
+        if cache_key and final_output:
+            store_cache_entry(cache_dir, cache_key, {'counter_end': counter_end}, cbl_filename, layout)
+
+    if stats:
+        stats.seconds = time.perf_counter() - start
+        if memo is not None:
+            stats.memo_counters = {counter: value - memo_counters[counter] 
+                                   for counter, value in memo.counters().items()}
+        write_json(stats.to_dict(), stats_path(stats_dir, cbl_filename))
+
+    if final_output:
         print('File with name ' + cbl_filename + ' formatted successfully.')
         if counter_end and type(counter_end) is int:
             print('The incremented counter ended on ' + str(counter_end-1) + '. The next count should begin on ' 
@@ -29,480 +162,2735 @@ def complete_pipeline(pl1_filename, cbl_filename, counter_start):
     return counter_end
 
 
+def convert_pl1_lines(pl1_text, counter_start, pl1_filename='<text>', stream=False, parser='heuristic', stats=None, 
+                      memo=None, report=None, layout=None):
+    '''
+    Runs the four processing stages over the lines of a Pl1 copybook, without reading or writing any files. Returns 
+    the 72-character COBOL lines and 'counter_end', or with 'stream' set, a generator of them and the 'counter_state' 
+    dict that will hold 'counter_end' once it is exhausted.
+
+    With 'parser' set to 'structured', the copybook is instead tokenized and parsed into Declarations in a single 
+    pass, which are translated into FieldRecords, numbered in place and only then rendered as text (see 
+    parse_declarations() and FieldRecord). Its layout is normalized rather than following the source columns, and 
+    the counter advances once per declaration rather than once per line.
+
+    With a PipelineStats passed in as 'stats', the stages are always chained as generators so each one can be timed 
+    and counted through PipelineStats.instrument(), and the lines are only gathered into a list at the end. Without 
+    it, nothing is wrapped at all.
+
+    With a GroupMemo passed in as 'memo', the heuristic path reuses the third stage's lines for any group it has 
+    converted before, in this copybook or any other, with the same result (see GroupMemo). With a ValidationReport 
+    passed in as 'report', either path records the malformed lines that would otherwise raise, with the line of the 
+    source each was found on, and the conversion carries on.
+
+    With a LayoutWriter passed in as 'layout', every field is added to it as it is converted: from the branches of 
+    replace_pl1_expressions_and_add_periods() on the heuristic path, with the names numbered as increment_field_names() 
+    numbers them, or from the numbered FieldRecords on the structured path. It is finished once the last field is.
+    '''
+
+    lazy = stream or stats is not None
+    instrument = stats.instrument if stats is not None else lambda stage_name, lines: lines
+    pl1_text = instrument('read_open_pl1_and_cobol_files', pl1_text)
+
+    if parser == 'structured':
+        counter_state = {'counter_end': 0}
+        declarations = instrument('parse_declarations', 
+                                  parse_declarations(tokenize_pl1(pl1_text), pl1_filename, report))
+        field_records = instrument('build_field_records', build_field_records(declarations, pl1_filename, report))
+        field_records = instrument('number_field_records', 
+                                   number_field_records(field_records, counter_start, counter_state))
+        if layout is not None:
+            field_records = lay_out_field_records(field_records, layout)
+        cobol_text = instrument('render_field_records', render_field_records(field_records, pl1_filename, report))
+        if stream:
+            return cobol_text, counter_state
+        cobol_text = list(cobol_text)
+        return cobol_text, counter_state['counter_end']
+
+    elif parser != 'heuristic':
+        raise Exception(f"Unknown parser '{parser}'. Use either 'heuristic' or 'structured'.")
+
+    new_pl1_text_1 = instrument('remove_comments_and_add_header', 
+                                remove_comments_and_add_header(pl1_text, lazy, report))
+    new_pl1_text_2 = instrument('general_formatting', general_formatting(new_pl1_text_1, lazy))
+    if layout is not None:
+        layout.number_names(counter_start)
+    # Stage 3's FieldLines are always streamed into stage 4, so only the few in flight are ever held at once:
+    new_pl1_text_3 = instrument('replace_pl1_expressions_and_add_periods', 
+                                replace_pl1_expressions_and_add_periods(new_pl1_text_2, pl1_filename, True, memo, 
+                                                                        report, stats, layout))
+    if not lazy:
+        return clean_up_formatting_and_increment_field_names(new_pl1_text_3, counter_start)
+
+    cobol_text, counter_state = clean_up_formatting_and_increment_field_names(new_pl1_text_3, counter_start, True, 
+                                                                              stats)
+    cobol_text = instrument('clean_up_formatting_and_increment_field_names', cobol_text)
+    if stream:
+        return cobol_text, counter_state
+    cobol_text = list(cobol_text)
+    
+    return cobol_text, counter_state['counter_end']
+
+
+
+
+# LIBRARY API: CONVERTING COPYBOOKS IN MEMORY, WITH NO FILES AND NO PRINTING
+def convert_text(pl1_text, counter_start=1, pl1_filename='<text>', parser='heuristic', stats=None, memo=None, 
+                 report=None, layout=None):
+    '''
+    Converts a Pl1 copybook passed in either as one string or as a list of lines, and returns a tuple of:
+        - the COBOL lines, each 72 characters long and without linebreaks,
+        - 'counter_end', where the field name counter of the next copybook should begin (0 if counting is disabled),
+        - a list of diagnostics dicts, one for each line that did not come out at exactly 72 characters.
+
+    Nothing is read from or written to disk and nothing is printed, so services can call it directly. Malformed 
+    copybooks still raise, naming 'pl1_filename' in the message. 'parser' selects the conversion path, as in 
+    convert_pl1_lines(). A PipelineStats passed in as 'stats' collects the timings and counters of the conversion, 
+    and a GroupMemo passed in as 'memo' is used as in convert_pl1_lines(). With a ValidationReport passed in as 
+    'report', malformed lines are recorded in it instead of raising, and its diagnostics are the ones returned. A 
+    LayoutWriter passed in as 'layout' is given every field, as in convert_pl1_lines().
+    '''
+
+    if isinstance(pl1_text, str):
+        pl1_text = pl1_text.splitlines(keepends=True)
+
+    with stats.counting_patterns() if stats is not None else contextlib.nullcontext():
+        cobol_lines, counter_end = convert_pl1_lines(pl1_text, counter_start, pl1_filename, parser=parser, stats=stats, 
+                                                     memo=memo, report=report, layout=layout)
+    report = report if report is not None else ValidationReport(pl1_filename)
+    for i, line in enumerate(cobol_lines):
+        if len(line) != 72:
+            report.add('clean_up_formatting_and_increment_field_names', 'line_length', 
+                       f'Line number {i} NOT 72 chars: {line}', i)
+
+    return cobol_lines, counter_end, report.diagnostics
+
+
+
+
+# BATCH: CONVERTING MANY FILES IN PARALLEL ACROSS ALL CORES
+def count_field_counter_lines(pl1_filename, cache_dir=None, parser='heuristic', mapped=False):
+    '''
+    Cheap pre-pass that returns how far increment_field_names() will advance the counter for a file: it counts every 
+    line leaving replace_pl1_expressions_and_add_periods(), numbered or not. Only the first three stages are run, 
+    streamed, so the output is never built or written. For the 'structured' parser, the declarations are counted 
+    instead. With a 'cache_dir', the count of an unchanged copybook is reused as well.
+    '''
+
+    cache_key = generate_cache_key(pl1_filename, None, parser, mapped) if cache_dir else None
+    if cache_key and (cache_entry := read_cache_entry(cache_dir, cache_key)):
+        return cache_entry['line_count']
+
+    pl1_text = read_open_pl1_and_cobol_files(pl1_filename, stream=True, mapped=mapped)
+    line_count = count_text_lines(pl1_text, pl1_filename, parser)
+    if cache_key:
+        store_cache_entry(cache_dir, cache_key, {'line_count': line_count})
+    
+    return line_count
+
+
+def count_text_lines(pl1_text, pl1_filename='<text>', parser='heuristic'):
+    '''The counting behind count_field_counter_lines(), for a copybook passed in as a string or an iterable of lines.'''
+
+    if isinstance(pl1_text, str):
+        pl1_text = pl1_text.splitlines(keepends=True)
+
+    if parser == 'structured':
+        return sum(1 for declaration in parse_declarations(tokenize_pl1(pl1_text), pl1_filename))
+
+    new_pl1_text_1 = remove_comments_and_add_header(pl1_text, stream=True)
+    new_pl1_text_2 = general_formatting(new_pl1_text_1, stream=True)
+    new_pl1_text_3 = replace_pl1_expressions_and_add_periods(new_pl1_text_2, pl1_filename, stream=True)
+    
+    return sum(1 for line in new_pl1_text_3)
+
+
+def parallel_batch_pipeline(pl1_filenames, cbl_filenames, counter_start, stream=False, fsync=False, processes=None, 
+                            cache_dir=None, parser='heuristic', stats_dir=None, mapped=False, layout=None, 
+                            changes=None):
+    '''
+    Converts many files across a process pool. The pre-pass counts each file's lines in parallel first, so every 
+    worker is handed the 'counter_start' it would have received from the file before it in a sequential run, making 
+    the output byte-identical. Returns the same final 'counter_end' as the sequential run. With a 'stats_dir', each 
+    worker writes the stats of its own file there, for write_batch_stats() to aggregate afterwards. A 'changes' dict 
+    is filled in through a shared proxy, as every worker records whether its file changed.
+    '''
+
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    number_of_files = len(pl1_filenames)
+    manager = multiprocessing.Manager() if changes is not None else contextlib.nullcontext()
+    with manager, ProcessPoolExecutor(max_workers=processes) as executor:
+        shared_changes = manager.dict() if changes is not None else None
+        count_lines = functools.partial(count_field_counter_lines, cache_dir=cache_dir, parser=parser, mapped=mapped)
+        line_counts = list(executor.map(count_lines, pl1_filenames))
+
+        # Assign each file its counter range in order, just as the sequential loop threads it from file to file:
+        counter_starts, counter = [], counter_start
+        for line_count in line_counts:
+            counter_starts.append(counter)
+            counter = counter + line_count if counter > 0 else 0
+
+        convert = functools.partial(complete_pipeline, stream=stream, fsync=fsync, cache_dir=cache_dir, parser=parser, 
+                                    stats_dir=stats_dir, mapped=mapped, layout=layout, changes=shared_changes)
+        counter_ends = list(executor.map(convert, pl1_filenames, cbl_filenames, counter_starts))
+        if changes is not None:
+            changes.update((cbl_filename, shared_changes[cbl_filename]) for cbl_filename in cbl_filenames)
+
+    # Every file must have ended exactly where the next one was assigned to begin:
+    if counter_ends != counter_starts[1:] + [counter]:
+        raise Exception('Field counter ranges assigned by the pre-pass did not match the converted files.')
+    
+    return counter
+
+
+
+
+def manifest_batch_pipeline(manifest_filename, counter_start, checkpoint_filename=None, stream=False, fsync=False, 
+                            cache_dir=None, parser='heuristic', stats_dir=None, mapped=False, memo=None, 
+                            layout=None, changes=None):
+    '''
+    Converts every copybook listed in the manifest, one filename per line (blank lines and lines starting with '#' 
+    are skipped), recording each file's status, counter range and output hash in a JSON checkpoint, 
+    '<manifest>.checkpoint.json' unless 'checkpoint_filename' says otherwise. Files that fail are recorded along 
+    with their error and the run carries on with the next one, instead of aborting.
+
+    As it goes, each file's entry is only appended to a journal next to the checkpoint, '<checkpoint>.journal', as 
+    one line of JSON flushed to disk, so recording a file costs the same however long the manifest is. At the end of 
+    the run, the journal is folded into the checkpoint and removed. A run that stopped before then is picked up 
+    from the checkpoint with the journal replayed on top of it, up to the last complete line.
+
+    Run again with the same checkpoint, finished files whose .cbl output still has the recorded hash are skipped, so 
+    a crashed or interrupted run resumes where it stopped, from the counter it had reached. Failed files are retried, 
+    each given a fresh range after the highest one handed out so far, so no field name is ever reused.
+
+    Returns the next counter, the files converted by this run, and a dict of the files that failed with their errors.
+    '''
+
+    def is_finished(file_entry):
+        '''A file is finished once converted, as long as its output has not been changed or removed since.'''
+
+        if not file_entry or file_entry['status'] != 'done':
+            return False
+        try:
+            return file_sha256(file_entry['output']) == file_entry['output_sha256']
+        except OSError:
+            return False
+
+    with open(manifest_filename, 'r') as f:
+        pl1_filenames = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+    checkpoint_filename = checkpoint_filename or manifest_filename + '.checkpoint.json'
+    journal_filename = checkpoint_filename + '.journal'
+    checkpoint = {'manifest': manifest_filename, 'next_counter': counter_start, 'files': {}}
+    resuming = False
+    try:
+        with open(checkpoint_filename, 'r') as f:
+            checkpoint = json.load(f)
+        resuming = True
+    except FileNotFoundError:
+        pass
+    try:
+        with open(journal_filename, 'r') as f:
+            for line in f:
+                try:
+                    journal_entry = json.loads(line)
+                except ValueError:
+                    break # the last line was cut short when the run stopped
+                checkpoint['files'][journal_entry['file']] = journal_entry['entry']
+                checkpoint['next_counter'] = journal_entry['next_counter']
+        resuming = True
+    except FileNotFoundError:
+        pass
+    if resuming:
+        print(f'Resuming from {checkpoint_filename}. The next count will begin on {checkpoint["next_counter"]}.')
+
+    def record(pl1_filename, file_entry):
+        '''Journals a file's entry, on disk before the next file is started.'''
+
+        checkpoint['files'][pl1_filename] = file_entry
+        journal.write(json.dumps({'file': pl1_filename, 'entry': file_entry, 
+                                  'next_counter': checkpoint['next_counter']}) + '\n')
+        journal.flush()
+        os.fsync(journal.fileno())
+
+    converted, failures = [], {}
+    with open(journal_filename, 'a') as journal:
+        for pl1_filename in pl1_filenames:
+            file_entry = checkpoint['files'].get(pl1_filename)
+            if is_finished(file_entry):
+                continue
+
+            try:
+                # A file converted before keeps its range if it still fits; any other starts where the last range
+                # ended:
+                start = checkpoint['next_counter']
+                if file_entry and file_entry['status'] == 'done' and start > 0:
+                    line_count = count_field_counter_lines(pl1_filename, cache_dir=cache_dir, parser=parser, 
+                                                           mapped=mapped)
+                    if file_entry['counter_start'] + line_count <= file_entry['counter_end']:
+                        start = file_entry['counter_start']
+
+                cbl_filename = generate_cbl_filename(pl1_filename)
+                counter_end = complete_pipeline(pl1_filename, cbl_filename, start, stream=stream, fsync=fsync, 
+                                                cache_dir=cache_dir, parser=parser, stats_dir=stats_dir, mapped=mapped, 
+                                                memo=memo, layout=layout, changes=changes)
+                file_entry = {'status': 'done', 'counter_start': start, 'counter_end': counter_end, 
+                              'output': cbl_filename, 'output_sha256': file_sha256(cbl_filename)}
+                checkpoint['next_counter'] = max(checkpoint['next_counter'], counter_end) if start > 0 else 0
+                record(pl1_filename, file_entry)
+                converted.append(pl1_filename)
+            except Exception as e:
+                print(f'Could not convert {pl1_filename}: {e}')
+                record(pl1_filename, {'status': 'failed', 'error': str(e)})
+                failures[pl1_filename] = str(e)
+
+    # Fold the journal into the checkpoint, which is written whole before the journal is removed:
+    write_json(checkpoint, checkpoint_filename)
+    os.remove(journal_filename)
+
+    finished = sum(1 for pl1_filename in pl1_filenames if checkpoint['files'][pl1_filename]['status'] == 'done')
+    print(f'{finished} of {len(pl1_filenames)} files in {manifest_filename} are converted, {len(converted)} of them '
+          f'by this run. The next count should begin on {checkpoint["next_counter"]}.')
+    for pl1_filename, error in failures.items():
+        print(f'    FAILED {pl1_filename}: {error}')
+
+    return checkpoint['next_counter'], converted, failures
+
+
+
+
+# INSTRUMENTATION: PER-STAGE TIMINGS AND COUNTERS, ONLY COLLECTED WHEN ASKED FOR
+class CountingPattern:
+    '''
+    Stands in for a compiled pattern in PATTERNS while a PipelineStats is counting, and tallies every call that 
+    found a match against the stage running at the time. Anything else is passed through to the wrapped pattern.
+    '''
+
+    __slots__ = ('name', 'pattern', 'stats')
+
+    def __init__(self, name, pattern, stats):
+        self.name, self.pattern, self.stats = name, pattern, stats
+
+    def __getattr__(self, attribute):
+        return getattr(self.pattern, attribute)
+
+    def count(self, number_of_matches=1):
+        stage_name = self.stats.active_stages[-1] if self.stats.active_stages else '<outside stages>'
+        regex_matches = self.stats.stage(stage_name)['regex_matches']
+        regex_matches[self.name] = regex_matches.get(self.name, 0) + number_of_matches
+
+    def search(self, *args):
+        if (result := self.pattern.search(*args)):
+            self.count()
+        return result
+
+    def match(self, *args):
+        if (result := self.pattern.match(*args)):
+            self.count()
+        return result
+
+    def findall(self, *args):
+        if (result := self.pattern.findall(*args)):
+            self.count(len(result))
+        return result
+
+    def finditer(self, *args):
+        for result in self.pattern.finditer(*args):
+            self.count()
+            yield result
+
+    def sub(self, repl, string, count=0):
+        new_string, number_of_matches = self.pattern.subn(repl, string, count)
+        if number_of_matches:
+            self.count(number_of_matches)
+        return new_string
+
+
+class PipelineStats:
+    '''
+    Collects, for one copybook, the wall time and lines out of every stage along with how many times each of its 
+    patterns matched. Pass one to convert_text() or convert_pl1_lines(), or give complete_pipeline() a 'stats_dir'.
+
+    Stages are chained generators, so a stage's time is measured around each line pulled from it and the time spent 
+    pulling from the stage before it is taken back out, leaving every stage with only its own share of the run. The 
+    patterns are swapped process-wide while counting_patterns() is active, so instrumented conversions should not 
+    run in several threads of the same process at once.
+    '''
+
+    # Counters derived from the pattern matches that mark each event:
+    COUNTER_PATTERNS = {
+        'occurs_rewritten': ['occurs'],                   # OCCURS clauses rewritten in stage 3, plus stage 4's events
+        'right_pad_splits': ['pic_clause'],               # lines over 72 chars split in two by right_pad()
+    }
+
+    def __init__(self, pl1_filename='<text>', cbl_filename=None, parser='heuristic'):
+        self.pl1_filename, self.cbl_filename, self.parser = pl1_filename, cbl_filename, parser
+        self.stages, self.active_stages = {}, []
+        self.cache_hit, self.seconds = False, 0.0
+        self.event_counters = {'holdovers_merged': 0} # tallied by the stages themselves, through count_event()
+        self.memo_counters = {} # filled in by complete_pipeline() when it is given a GroupMemo
+
+    def count_event(self, counter, number=1):
+        '''Adds to a counter of events that no single pattern match marks, such as a holdover merged into a line.'''
+
+        self.event_counters[counter] = self.event_counters.get(counter, 0) + number
+
+    def stage(self, stage_name):
+        '''Returns the stats dict of 'stage_name', creating it in pipeline order the first time it is seen.'''
+
+        if stage_name not in self.stages:
+            self.stages[stage_name] = {'seconds': 0.0, 'lines_out': 0, 'regex_matches': {}}
+        return self.stages[stage_name]
+
+    def add_time(self, stage_name, start):
+        '''Adds the time since 'start' to 'stage_name' and takes it back out of the stage that pulled from it.'''
+
+        elapsed = time.perf_counter() - start
+        self.stage(stage_name)['seconds'] += elapsed
+        if self.active_stages:
+            self.stage(self.active_stages[-1])['seconds'] -= elapsed
+
+    def instrument(self, stage_name, lines):
+        '''
+        Returns a generator of the lines coming out of a stage, timing each one and counting them as that stage's 
+        output. The stage is registered straight away, so stages keep the order they were chained in.
+        '''
+
+        def timed_lines(stage_stats, lines):
+            while True:
+                self.active_stages.append(stage_name)
+                start = time.perf_counter()
+                try:
+                    line = next(lines)
+                except StopIteration:
+                    return
+                finally:
+                    self.active_stages.pop()
+                    self.add_time(stage_name, start)
+                stage_stats['lines_out'] += 1
+                yield line
+
+        return timed_lines(self.stage(stage_name), iter(lines))
+
+    @contextlib.contextmanager
+    def section(self, stage_name):
+        '''Times a stage that consumes lines rather than yielding them, such as write_output_to_file().'''
+
+        self.stage(stage_name)
+        self.active_stages.append(stage_name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.active_stages.pop()
+            self.add_time(stage_name, start)
+
+    @contextlib.contextmanager
+    def counting_patterns(self):
+        '''Swaps every pattern in PATTERNS for a CountingPattern for the duration, unless one already has.'''
+
+        if any(isinstance(pattern, CountingPattern) for pattern in PATTERNS.values()):
+            yield
+            return
+
+        original_patterns = PATTERNS.compile_all()
+        PATTERNS.update({name: CountingPattern(name, pattern, self) for name, pattern in original_patterns.items()})
+        try:
+            yield
+        finally:
+            PATTERNS.update(original_patterns)
+
+    def to_dict(self):
+        '''
+        Returns the stats as a JSON-serializable dict. Each stage's 'lines_in' is the 'lines_out' of the stage 
+        before it, and the write stage's 'lines_out' is the lines it wrote.
+        '''
+
+        stages, lines_in = {}, None
+        for stage_name, stage_stats in self.stages.items():
+            stages[stage_name] = {'seconds': stage_stats['seconds'], 'lines_in': lines_in, 
+                                  'lines_out': stage_stats['lines_out'], 
+                                  'regex_matches': dict(stage_stats['regex_matches'])}
+            lines_in = stage_stats['lines_out']
+        if 'write_output_to_file' in stages:
+            stages['write_output_to_file']['lines_out'] = stages['write_output_to_file']['lines_in']
+
+        regex_matches = {}
+        for stage_stats in stages.values():
+            for name, number_of_matches in stage_stats['regex_matches'].items():
+                regex_matches[name] = regex_matches.get(name, 0) + number_of_matches
+        counters = dict(self.event_counters)
+        counters.update({counter: counters.get(counter, 0) + sum(regex_matches.get(name, 0) for name in names) 
+                         for counter, names in self.COUNTER_PATTERNS.items()})
+        counters.update(self.memo_counters)
+
+        return {'files': 1, 'file': self.pl1_filename, 'output': self.cbl_filename, 'parser': self.parser, 
+                'cache_hits': int(self.cache_hit), 'seconds': self.seconds, 'stages': stages, 'counters': counters}
+
+
+def aggregate_stats(stats_dicts):
+    '''Sums a batch of PipelineStats.to_dict() results stage by stage into one dict of the same shape.'''
+
+    aggregate = {'files': 0, 'cache_hits': 0, 'seconds': 0.0, 'stages': {}, 'counters': {}}
+    for stats_dict in stats_dicts:
+        for key in ('files', 'cache_hits', 'seconds'):
+            aggregate[key] += stats_dict[key]
+        for counter, value in stats_dict['counters'].items():
+            aggregate['counters'][counter] = aggregate['counters'].get(counter, 0) + value
+
+        for stage_name, stage_stats in stats_dict['stages'].items():
+            stage_total = aggregate['stages'].setdefault(stage_name, {'seconds': 0.0, 'lines_in': None, 
+                                                                      'lines_out': 0, 'regex_matches': {}})
+            stage_total['seconds'] += stage_stats['seconds']
+            stage_total['lines_out'] += stage_stats['lines_out']
+            if stage_stats['lines_in'] is not None:
+                stage_total['lines_in'] = (stage_total['lines_in'] or 0) + stage_stats['lines_in']
+            for name, number_of_matches in stage_stats['regex_matches'].items():
+                stage_total['regex_matches'][name] = stage_total['regex_matches'].get(name, 0) + number_of_matches
+    
+    return aggregate
+
+
+def stats_path(stats_dir, cbl_filename):
+    return os.path.join(stats_dir, os.path.basename(cbl_filename) + '.stats.json')
+
+
+def write_batch_stats(stats_dir, cbl_filenames):
+    '''Aggregates the stats written for every file of a batch into 'batch.stats.json' in 'stats_dir'.'''
+
+    stats_dicts = []
+    for cbl_filename in cbl_filenames:
+        with open(stats_path(stats_dir, cbl_filename), 'r') as f:
+            stats_dicts.append(json.load(f))
+    batch_stats = aggregate_stats(stats_dicts)
+    write_json(batch_stats, os.path.join(stats_dir, 'batch.stats.json'))
+    
+    return batch_stats
+
+
+
+
+# VALIDATION: REPORTING EVERY PROBLEM ACROSS A LIBRARY IN ONE PASS INSTEAD OF STOPPING AT THE FIRST
+class ValidationReport:
+    '''
+    Collects the problems found while converting one copybook as diagnostics dicts of: its filename, the line of the 
+    source file counting from 1 ('source_line', where the stage can tell), the line as numbered by the stage that 
+    found it ('line'), the stage, the rule broken, a severity of 'error' or 'warning', and a message. Pass one to 
+    convert_text() or convert_pl1_lines() and malformed lines are recorded in it instead of raising. With a 'sink', 
+    each diagnostic is also written to it as a line of JSON as soon as it is found.
+    '''
+
+    def __init__(self, pl1_filename='<text>', sink=None):
+        self.pl1_filename, self.sink = pl1_filename, sink
+        self.diagnostics = []
+        self.removed_lines = (0, 0) # where and how many leading comment lines remove_comments_and_add_header() took out
+
+    def add(self, stage, rule, message, line=None, severity='error', source=False):
+        '''
+        Records a diagnostic. With 'source' set, 'line' was numbered before any lines were merged, so it is mapped 
+        back to the line of the source file as well.
+        '''
+
+        source_line = None
+        if source and line is not None:
+            removed_at, number_removed = self.removed_lines
+            source_line = line + 1 + (number_removed if line >= removed_at else 0)
+        diagnostic = {'file': self.pl1_filename, 'source_line': source_line, 'line': line, 'stage': stage, 
+                      'rule': rule, 'severity': severity, 'message': message}
+        self.diagnostics.append(diagnostic)
+        if self.sink is not None:
+            self.sink.write(json.dumps(diagnostic) + '\n')
+
+    def count(self, severity='error'):
+        return sum(1 for diagnostic in self.diagnostics if diagnostic['severity'] == severity)
+
+
+def validate_pipeline(pl1_filenames, counter_start, sink=None, write_output=True, parser='heuristic', mapped=False, 
+                      memo=None):
+    '''
+    Converts every copybook in one pass, writing each problem found to 'sink' (stdout by default) as a line of JSON 
+    as soon as it is found (see ValidationReport), instead of stopping at the first, so a whole library is checked 
+    in a single run. Anything else a copybook raises is reported as an error of the rule 'exception', and the run 
+    carries on with the next one. A copybook with any errors is never written, and with 'write_output' unset, none 
+    are, so the library is only validated.
+
+    Returns the next counter, and the number of errors and of warnings found across all the copybooks.
+    '''
+
+    sink = sink or sys.stdout
+    errors = warnings = 0
+    for pl1_filename in pl1_filenames:
+        report, stage = ValidationReport(pl1_filename, sink), 'read_open_pl1_and_cobol_files'
+        try:
+            pl1_text = read_open_pl1_and_cobol_files(pl1_filename, mapped=mapped)
+            stage = 'convert_pl1_lines'
+            cobol_lines, counter_end, diagnostics = convert_text(pl1_text, counter_start, pl1_filename, parser, 
+                                                                 memo=memo, report=report)
+            if write_output and not report.count('error'):
+                stage = 'write_output_to_file'
+                write_output_to_file(cobol_lines, generate_cbl_filename(pl1_filename))
+            counter_start = counter_end
+        except Exception as e:
+            report.add(stage, 'exception', str(e))
+        sink.flush()
+        errors, warnings = errors + report.count('error'), warnings + report.count('warning')
+    
+    return counter_start, errors, warnings
+
+
+
+
+# WATCH: KEEPING A DIRECTORY OF COPYBOOKS CONVERTED AS THEY ARE EDITED
+INOTIFY_EVENTS = 0x8 | 0x40 | 0x80 | 0x200 # IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+def watch_pipeline(directory, counter_start, pattern='*.pli', stream=False, fsync=False, cache_dir=None, 
+                   parser='heuristic', interval=1.0, stats_dir=None, mapped=False, memo=None, layout=None, 
+                   changes=None):
+    '''
+    Long-running mode that converts every copybook in 'directory' whose name matches 'pattern', then reconverts 
+    only the ones that change, until interrupted. Each conversion goes through complete_pipeline() with the other 
+    options passed along unchanged.
+
+    Every file keeps the counter range it was given by the first pass, so editing one copybook never renumbers the 
+    others. A file whose new line count still fits its range is reconverted from the same 'counter_start'; one that 
+    has outgrown it, or a file added since, is given a fresh range after the highest one handed out so far. Ranges 
+    live only as long as the process, so a restart numbers the directory sequentially again.
+    '''
+
+    import fnmatch
+
+    counter_ranges, next_counter = {}, counter_start
+
+    def list_copybooks():
+        return sorted(name for name in os.listdir(directory) if fnmatch.fnmatch(name, pattern))
+
+    def convert(name, start):
+        '''Converts one copybook from 'start', returning its 'counter_end' or None if the copybook is invalid.'''
+
+        pl1_filename = os.path.join(directory, name)
+        try:
+            return complete_pipeline(pl1_filename, generate_cbl_filename(pl1_filename), start, stream=stream, 
+                                     fsync=fsync, cache_dir=cache_dir, parser=parser, stats_dir=stats_dir, 
+                                     mapped=mapped, memo=memo, layout=layout, changes=changes)
+        except Exception as e:
+            print(f'Could not convert {pl1_filename}: {e}')
+            return None
+
+    def reconvert(name):
+        '''Reconverts a changed copybook inside its own counter range, moving it past the others if it outgrew it.'''
+
+        nonlocal next_counter
+        if counter_start == 0:
+            convert(name, 0)
+            return
+
+        try:
+            line_count = count_field_counter_lines(os.path.join(directory, name), cache_dir=cache_dir, parser=parser, 
+                                                   mapped=mapped)
+        except Exception as e:
+            print(f'Could not convert {os.path.join(directory, name)}: {e}')
+            return
+
+        start, reserved_end = counter_ranges.get(name, (None, None))
+        if start is None or start + line_count > reserved_end:
+            start, reserved_end = next_counter, next_counter + line_count
+            next_counter = reserved_end
+            print(f'{name} was given the counter range {start} to {reserved_end - 1}.')
+        if convert(name, start) is not None:
+            counter_ranges[name] = (start, reserved_end)
+
+    # First pass: numbers the directory sequentially, exactly as a batch run would:
+    for name in list_copybooks():
+        if (counter_end := convert(name, next_counter)) is not None:
+            counter_ranges[name] = (next_counter, counter_end)
+            next_counter = counter_end
+
+    print(f'Watching {directory} for changes to {pattern} files. Press Ctrl+C to stop.')
+    try:
+        for changed_names in watch_changes(directory, interval):
+            for name in sorted(changed_names):
+                if not fnmatch.fnmatch(name, pattern):
+                    continue
+                if os.path.exists(os.path.join(directory, name)):
+                    reconvert(name)
+                elif counter_ranges.pop(name, None):
+                    print(f'{name} was removed. Its counter range will not be reused.')
+    except KeyboardInterrupt:
+        pass
+
+    return next_counter
+
+
+def watch_changes(directory, interval=1.0):
+    '''
+    Yields sets of names in 'directory' that were written, moved or deleted. Uses inotify where the C library 
+    provides it, and otherwise falls back to comparing modification times every 'interval' seconds.
+    '''
+
+    try:
+        changes = inotify_changes(directory)
+        next(changes)
+    except OSError:
+        changes = poll_changes(directory, interval)
+    yield from changes
+
+
+def inotify_changes(directory, settle=0.2):
+    '''
+    Yields the names inotify reports for 'directory', gathering events until none arrive for 'settle' seconds, 
+    since editors often save a file in several steps. Raises OSError if inotify is not available.
+    '''
+
+    import ctypes, ctypes.util, select, struct
+
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        raise OSError('inotify is not available on this platform.')
+    if (fd := libc.inotify_init1(os.O_CLOEXEC)) < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init1 failed.')
+
+    try:
+        if libc.inotify_add_watch(fd, os.fsencode(directory), INOTIFY_EVENTS) < 0:
+            raise OSError(ctypes.get_errno(), f'Could not watch {directory}.')
+        yield set() # watching has started, before anything is read
+
+        while True:
+            changed_names = set()
+            while not changed_names or select.select([fd], [], [], settle)[0]:
+                events, offset = os.read(fd, 64 * 1024), 0
+
+                # Each event is a 16-byte header (wd, mask, cookie, len) followed by a NUL-padded name:
+                while offset < len(events):
+                    name_length = struct.unpack_from('iIII', events, offset)[3]
+                    name = events[offset + 16:offset + 16 + name_length].rstrip(b'\0')
+                    if name:
+                        changed_names.add(os.fsdecode(name))
+                    offset += 16 + name_length
+            yield changed_names
+    finally:
+        os.close(fd)
+
+
+def poll_changes(directory, interval=1.0):
+    '''Yields the names in 'directory' whose modification time or size changed, or that appeared or vanished.'''
+
+    def snapshot():
+        snapshot = {}
+        for entry in os.scandir(directory):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            snapshot[entry.name] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    previous = snapshot()
+    while True:
+        time.sleep(interval)
+        current = snapshot()
+        if (changed_names := {name for name in previous.keys() | current.keys() 
+                              if previous.get(name) != current.get(name)}):
+            yield changed_names
+        previous = current
+
+
+
+
+# SERVICE: CONVERTING COPYBOOKS SENT OVER A LOCAL SOCKET BY OTHER BUILD JOBS
+def serve_pipeline(address, counter_start, parser='heuristic', processes=None, concurrency=None, queue_size=None):
+    '''
+    Runs a conversion service on 'address', either "HOST:PORT" for TCP or "unix:PATH" for a Unix socket, until 
+    interrupted. Any number of requests may be sent over one connection, each made of:
+        - a header line of JSON, e.g. {"filename": "CUST.pli", "length": 1234}, optionally with a "parser",
+        - followed by exactly "length" bytes of the copybook's UTF-8 text.
+    Each is answered, in order, with:
+        - a header line of JSON: {"status": "ok", "lines": N, "counter_start": S, "counter_end": E, 
+          "diagnostics": [...]}, or {"status": "error", "message": "..."} with nothing after it,
+        - followed by the N converted COBOL lines, each 72 characters and a linebreak.
+
+    Conversions run in a process pool of 'processes' workers, at most 'concurrency' at a time (defaults to the 
+    number of processes). Up to 'queue_size' more requests wait their turn (defaults to twice 'concurrency'); beyond 
+    that, the service stops reading from the connection until there is room, so clients are slowed down rather than 
+    piling copybooks up in memory.
+
+    Every request is given its own counter range starting from 'counter_start', just as consecutive files of the 
+    sequential CLI are, so field names stay unique across everything the service converts. The range is reserved 
+    once the copybook's lines have been counted, with nothing awaited in between, so concurrent requests can never 
+    be handed overlapping ranges.
+    '''
+
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+
+    next_counter = counter_start
+    concurrency = concurrency or processes or os.cpu_count() or 1
+    queue_size = queue_size or 2 * concurrency
+
+    async def convert_request(executor, pl1_text, pl1_filename, request_parser):
+        '''Counts the copybook's lines in the pool, reserves its counter range, then converts it in the pool.'''
+
+        nonlocal next_counter
+        loop = asyncio.get_running_loop()
+        line_count = await loop.run_in_executor(executor, count_text_lines, pl1_text, pl1_filename, request_parser)
+
+        # Reserve the range in a single step of the event loop:
+        start = next_counter
+        next_counter = reserved_end = start + line_count if start > 0 else 0
+
+        cobol_lines, counter_end, diagnostics = await loop.run_in_executor(executor, convert_text, pl1_text, start, 
+                                                                           pl1_filename, request_parser)
+        if counter_end != reserved_end:
+            raise Exception(f'Field counter range reserved for {pl1_filename} did not match the converted copybook.')
+        
+        return {'status': 'ok', 'lines': len(cobol_lines), 'counter_start': start, 'counter_end': counter_end, 
+                'diagnostics': diagnostics}, cobol_lines
+
+    async def work(executor, queue):
+        '''Worker task: converts queued requests one at a time, handing each result back through its future.'''
+
+        while True:
+            pl1_text, pl1_filename, request_parser, result = await queue.get()
+            try:
+                result.set_result(await convert_request(executor, pl1_text, pl1_filename, request_parser))
+            except Exception as e:
+                result.set_result(({'status': 'error', 'message': str(e)}, []))
+            finally:
+                queue.task_done()
+
+    async def handle_connection(reader, writer, queue):
+        '''Reads requests off one connection, queues them, and streams each response back in order.'''
+
+        try:
+            while (header_line := await reader.readline()):
+                try:
+                    header = json.loads(header_line)
+                    pl1_text = (await reader.readexactly(int(header['length']))).decode('utf-8')
+                except (ValueError, KeyError, TypeError, asyncio.IncompleteReadError) as e:
+                    writer.write(json.dumps({'status': 'error', 'message': f'Malformed request: {e}'}).encode() + b'\n')
+                    break
+
+                # Waits here while the queue is full, which stops this connection from being read any further:
+                result = asyncio.get_running_loop().create_future()
+                await queue.put((pl1_text, header.get('filename', '<text>'), header.get('parser', parser), result))
+                response, cobol_lines = await result
+
+                writer.write(json.dumps(response).encode() + b'\n')
+                for i in range(0, len(cobol_lines), 1000):
+                    writer.write(''.join(line + '\n' for line in cobol_lines[i:i + 1000]).encode('utf-8'))
+                    await writer.drain()
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def run_service():
+        queue = asyncio.Queue(maxsize=queue_size)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            workers = [asyncio.create_task(work(executor, queue)) for i in range(concurrency)]
+            handler = lambda reader, writer: handle_connection(reader, writer, queue)
+            if address.startswith('unix:'):
+                server = await asyncio.start_unix_server(handler, address[len('unix:'):])
+            else:
+                host, port = address.rsplit(':', 1)
+                server = await asyncio.start_server(handler, host or 'localhost', int(port))
+
+            print(f'Serving conversions on {address} with {concurrency} at a time. Press Ctrl+C to stop.')
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+
+    try:
+        asyncio.run(run_service())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if address.startswith('unix:') and os.path.exists(address[len('unix:'):]):
+            os.remove(address[len('unix:'):])
+
+    return next_counter
+
+
+
+
+# CACHE: REUSING THE OUTPUT OF COPYBOOKS THAT HAVE NOT CHANGED SINCE THE LAST RUN
+@functools.lru_cache(maxsize=None)
+def converter_version():
+    '''Hash of this script's own source, so every cached output is invalidated whenever the converter changes.'''
+
+    import hashlib
+
+    with open(__file__, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def generate_cache_key(pl1_filename, counter_start, parser='heuristic', mapped=False):
+    '''
+    Hashes the copybook's bytes together with the converter version, the parser and 'counter_start'. Passing None as 
+    'counter_start' gives the key for the counter-independent line count used by count_field_counter_lines(). Since 
+    the 'mapped' reader never sees past the 72nd column, its conversions are keyed apart as well.
+    '''
+
+    import hashlib
+
+    reader = 'mapped:' if mapped else ''
+    hash_object = hashlib.sha256(f'{converter_version()}:{parser}:{counter_start}:{reader}'.encode())
+    with open(os.path.join('./', pl1_filename), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hash_object.update(chunk)
+    
+    return hash_object.hexdigest()
+
+
+def read_cache_entry(cache_dir, cache_key):
+    '''
+    Returns the stored metadata for 'cache_key', or None on a miss. A hit bumps the entry's modification time, which 
+    is what prune_cache() evicts by.
+    '''
+
+    metadata_path = os.path.join(cache_dir, cache_key + '.json')
+    try:
+        with open(metadata_path, 'r') as f:
+            cache_entry = json.load(f)
+        os.utime(metadata_path)
+    except (OSError, ValueError):
+        return None
+    
+    return cache_entry
+
+
+def store_cache_entry(cache_dir, cache_key, cache_entry, cbl_filename=None, layout_format=None):
+    '''
+    Stores the metadata for 'cache_key', along with a copy of the converted .cbl file if one is given, and of its 
+    layout in 'layout_format' if one is given too. The metadata is written last, so an entry is never found before 
+    its copies are complete.
+    '''
+
+    import shutil
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_suffix = f'.{os.getpid()}.tmp'
+    copies = []
+    if cbl_filename:
+        copies.append((os.path.join('./', cbl_filename), os.path.join(cache_dir, cache_key + '.cbl')))
+        if layout_format:
+            copies.append((layout_path(cbl_filename, layout_format), 
+                           cached_layout_path(cache_dir, cache_key, layout_format)))
+    for filepath, cached_filepath in copies:
+        shutil.copyfile(filepath, cached_filepath + temp_suffix)
+        os.replace(cached_filepath + temp_suffix, cached_filepath)
+
+    metadata_path = os.path.join(cache_dir, cache_key + '.json')
+    with open(metadata_path + temp_suffix, 'w') as f:
+        json.dump(cache_entry, f)
+    os.replace(metadata_path + temp_suffix, metadata_path)
+
+
+def copy_cached_output(cache_dir, cache_key, cbl_filename, fsync=False, changes=None):
+    '''
+    Copies the stored .cbl file into place, atomically as write_output_to_file() does. Returns its size in bytes. 
+    Given a 'changes' dict, a .cbl file that already matches the stored one is left untouched, and whether it was 
+    'new', 'changed' or 'unchanged' is recorded under 'cbl_filename', as write_output_to_file() does.
+    '''
+
+    import shutil
+
+    filepath = os.path.join('./', cbl_filename)
+    cached_filepath = os.path.join(cache_dir, cache_key + '.cbl')
+    if changes is not None:
+        try:
+            unchanged = (os.path.getsize(filepath) == os.path.getsize(cached_filepath) 
+                         and file_sha256(filepath) == file_sha256(cached_filepath))
+            changes[cbl_filename] = 'unchanged' if unchanged else 'changed'
+        except FileNotFoundError:
+            unchanged, changes[cbl_filename] = False, 'new'
+        if unchanged:
+            return os.path.getsize(filepath)
+
+    temp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    try:
+        shutil.copyfile(cached_filepath, temp_filepath)
+        if fsync:
+            with open(temp_filepath, 'rb') as f:
+                os.fsync(f.fileno())
+        os.replace(temp_filepath, filepath)
+    except:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        raise
+    
+    return os.path.getsize(filepath)
+
+
+def cached_layout_path(cache_dir, cache_key, layout_format):
+    # Named so prune_cache() groups it with its entry without taking it for the entry's .json metadata
+    return os.path.join(cache_dir, f'{cache_key}.{layout_format}.layout')
+
+
+def copy_cached_layout(cache_dir, cache_key, cbl_filename, layout_format):
+    '''
+    Copies the layout stored in 'layout_format' into place next to 'cbl_filename', atomically. Returns False if the 
+    entry was stored without one. The key does not depend on the output's name, so an identical copybook converted 
+    under another name shares the entry, and the first line of a JSON layout, which names the .cbl file, is written 
+    afresh rather than copied.
+    '''
+
+    import shutil
+
+    filepath = layout_path(cbl_filename, layout_format)
+    temp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    try:
+        with open(cached_layout_path(cache_dir, cache_key, layout_format), 'rb') as cached_file, \
+                open(temp_filepath, 'wb') as f:
+            if layout_format == 'json':
+                cached_file.readline()
+                f.write(json_layout_header(cbl_filename) + b'\n')
+            shutil.copyfileobj(cached_file, f)
+        os.replace(temp_filepath, filepath)
+    except FileNotFoundError:
+        return False
+    except:
+        if os.path.exists(temp_filepath):
+            os.remove(temp_filepath)
+        raise
+    
+    return True
+
+
+def prune_cache(cache_dir, max_bytes):
+    '''
+    Evicts the least recently used entries until the cache takes up no more than 'max_bytes'. Passing 0 clears the 
+    whole cache, e.g. to invalidate it by hand.
+    '''
+
+    if not os.path.isdir(cache_dir):
+        return
+
+    # Group each entry's files together, with its metadata's modification time marking when it was last used:
+    entries = {}
+    for dir_entry in os.scandir(cache_dir):
+        entry = entries.setdefault(dir_entry.name.split('.')[0], {'last_used': 0, 'size': 0, 'paths': []})
+        stat = dir_entry.stat()
+        if dir_entry.name.endswith('.json'):
+            entry['last_used'] = stat.st_mtime
+        entry['size'] += stat.st_size
+        entry['paths'].append(dir_entry.path)
+
+    total_bytes = sum(entry['size'] for entry in entries.values())
+    for entry in sorted(entries.values(), key=lambda entry: entry['last_used']):
+        if total_bytes <= max_bytes:
+            break
+        for path in entry['paths']:
+            os.remove(path)
+        total_bytes -= entry['size']
+
+
+
+
+# MEMO: REUSING THE CONVERTED LINES OF GROUPS REPEATED ACROSS A LIBRARY
+class GroupMemo:
+    '''
+    Bounded table of the lines replace_pl1_expressions_and_add_periods() produced for each group it converted, keyed 
+    on the group's lines with their levels made relative to the group's own (see its replace_groups()). One memo 
+    passed to complete_pipeline() for every file of a batch lets an address or date block that many copybooks repeat 
+    be converted only once. Groups longer than 'max_group_lines' are not kept, and beyond 'max_entries' groups the 
+    least recently used one is evicted.
+    '''
+
+    def __init__(self, max_entries=4096, max_group_lines=256):
+        self.max_entries, self.max_group_lines = max_entries, max_group_lines
+        self.entries = {} # dicts keep their insertion order, so the first key is always the least recently used
+        self.hits = self.misses = self.lines_reused = self.evictions = 0
+
+    def find(self, key, level):
+        '''Returns the lines stored for 'key' at any level, or else at 'level', or None, counting the hit or miss.'''
+
+        for entry_key in ((key, None), (key, level)):
+            if (stored_lines := self.entries.pop(entry_key, None)) is not None:
+                self.entries[entry_key] = stored_lines
+                self.hits += 1
+                self.lines_reused += len(key[0])
+                return stored_lines
+        self.misses += 1
+        
+        return None
+
+    def store(self, key, level, stored_lines):
+        '''Stores the lines for 'key' at 'level', or at any level if 'level' is None.'''
+
+        self.entries[(key, level)] = stored_lines
+        if len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+            self.evictions += 1
+
+    def counters(self):
+        return {'memo_hits': self.hits, 'memo_misses': self.misses, 'memo_lines_reused': self.lines_reused}
+
+    def to_dict(self):
+        lookups = self.hits + self.misses
+        return {**self.counters(), 'memo_hit_rate': self.hits / lookups if lookups else 0.0, 
+                'memo_entries': len(self.entries), 'memo_evictions': self.evictions, 
+                'memo_max_entries': self.max_entries, 'memo_max_group_lines': self.max_group_lines}
+
+
+
+
+# READ/STORE FILES
+def read_open_pl1_and_cobol_files(filename, stream=False, mapped=False):
+    '''
+    Reads in every line of the file, or with 'stream' set, returns a generator yielding one line at a time.
+
+    With 'mapped' set, the file is memory-mapped instead of read, and each line is sliced out of the map lazily with 
+    only its first 72 columns ever decoded, since general_formatting() throws the rest away. The pages of the file 
+    are left to the OS rather than copied into Python strings, and are released again once read, so huge copybooks 
+    start converting straight away without their full text ever being held in memory.
+    '''
+
+    def stream_lines(filepath):
+        with open(filepath, 'r') as f:
+            yield from f
+
+    def map_lines(filepath, encoding=locale.getpreferredencoding(False)):
+        '''
+        Yields the first 72 columns of each line of the memory-mapped file, plus its linebreak. A line that is not 
+        plain ASCII is decoded whole before it is cut, so a multi-byte character is never split, and so is one with a 
+        comment running past the 72nd column.
+        '''
+
+        import mmap
+
+        with open(filepath, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+                find, position, file_size = mapped_file.find, 0, len(mapped_file)
+                can_release, released = hasattr(mmap, 'MADV_DONTNEED'), 0
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    mapped_file.madvise(mmap.MADV_SEQUENTIAL)
+
+                while position < file_size:
+                    # Hand the pages already read back to the OS every 16 MB, so they do not pile up while streaming:
+                    if can_release and position - released >= 1 << 24:
+                        release_end = position - position % mmap.PAGESIZE
+                        mapped_file.madvise(mmap.MADV_DONTNEED, released, release_end - released)
+                        released = release_end
+
+                    next_position = line_end = find(b'\n', position) + 1 or file_size
+
+                    # Lines no longer than 72 bytes are decoded whole, linebreak included, as text mode would:
+                    if line_end - position <= 73:
+                        line = mapped_file[position:line_end].decode(encoding)
+                        yield line[:-2] + '\n' if line.endswith('\r\n') else line
+                        position = next_position
+                        continue
+
+                    linebreak = '\n' if mapped_file[line_end - 1] == 10 else ''
+                    line_end -= len(linebreak) + (mapped_file[line_end - len(linebreak) - 1] == 13)
+
+                    # Comment delimiters past the 72nd column still matter to remove_comments_and_add_header():
+                    columns_end = min(line_end, position + 72)
+                    if find(b'/*', columns_end - 1, line_end) >= 0 or find(b'*/', columns_end - 1, line_end) >= 0:
+                        columns_end = line_end
+
+                    columns = mapped_file[position:columns_end]
+                    if columns.isascii():
+                        yield columns.decode(encoding) + linebreak
+                    else:
+                        line = mapped_file[position:line_end].decode(encoding)
+                        yield (line if columns_end == line_end else line[:72]) + linebreak
+                    position = next_position
+
+    filepath = os.path.join('./', filename)
+    if mapped:
+        return map_lines(filepath) if stream else list(map_lines(filepath))
+    if stream:
+        return stream_lines(filepath)
+
+    with open(filepath, 'r') as f:
+        file_text_list = f.readlines()
+
+    return file_text_list
+
+
+def write_json(json_object, filepath):
+    '''Writes an object as JSON, through a temporary file so a reader never sees it half-written.'''
+
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    temp_filepath = f'{filepath}.{os.getpid()}.tmp'
+    with open(temp_filepath, 'w') as f:
+        json.dump(json_object, f, indent=2)
+    os.replace(temp_filepath, filepath)
+
+
+def file_sha256(filename):
+    '''Hex SHA-256 of a file's contents, read a megabyte at a time.'''
+
+    import hashlib
+
+    hash_object = hashlib.sha256()
+    with open(os.path.join('./', filename), 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hash_object.update(chunk)
+    return hash_object.hexdigest()
+
+
+def generate_cbl_filename(pl1_filename):
+    '''Remove extensions and append .cbl'''
+
+    if (search := PATTERNS['file_extension'].search(pl1_filename)):
+        match_length = search.span()[1] - search.span()[0]
+        return pl1_filename[:-match_length] + '.cbl'
+    
+    else:
+        raise Exception(f'{pl1_filename} was not in proper format. The filename needs to have an extension.')
+
+
+
+# INITIAL FORMATTING
+def remove_comments_and_add_header(pl1_text, stream=False, report=None):
+    '''
+    Bundles and processes three basic initial functions. A ValidationReport passed in as 'report' is told how many 
+    lines were removed from the top, to map later line numbers back to the source, and warned if no header was found.
+    '''
+
+    def remove_leading_comments(pl1_text, re_exp=PATTERNS['leading_comment']):
+        '''
+        Remove leading comments at top of file. Lines between the first two comment delimiter lines are held back until 
+        the second one is found, and are kept if it never turns up.
+        '''
+        
+        comment_window, window_closed = [], False
+        for i, line in enumerate(pl1_text):
+            if window_closed:
+                yield line
+            elif comment_window:
+                if re_exp.search(line):
+                    if report is not None:
+                        report.removed_lines = (i - len(comment_window), len(comment_window))
+                    comment_window, window_closed = [], True
+                    yield line # the closing delimiter line is kept and blanked later on
+                else:
+                    comment_window.append(line)
+            elif re_exp.search(line):
+                comment_window.append(line)
+            else:
+                yield line
+
+        yield from comment_window
+
+    def remove_remaining_comments(pl1_text):
+        '''
+        Blanks out every comment in the rest of the file with spaces, so the columns of the remaining text do not 
+        move. Each line is scanned once from left to right, carrying over whether a comment is still open, so several 
+        comments on one line and comments spanning several lines are both removed, in time linear in the text.
+        '''
+
+        def blank(text):
+            linebreak = '\n' if text.endswith('\n') else ''
+            return ' ' * (len(text) - len(linebreak)) + linebreak
+        
+        in_comment = False
+        for line in pl1_text:
+            if not in_comment and '/*' not in line:
+                yield line
+                continue
+
+            # Close the comment left open by a previous line first, if this line closes it at all:
+            new_line, position = '', 0
+            if in_comment:
+                if (closing := line.find('*/')) < 0:
+                    yield blank(line)
+                    continue
+                new_line, position, in_comment = ' ' * (closing + 2), closing + 2, False
+
+            # Then blank each comment in turn, from its opening delimiter to its closing one:
+            while (opening := line.find('/*', position)) >= 0:
+                new_line += line[position:opening]
+                if (closing := line.find('*/', opening + 2)) < 0:
+                    position, in_comment = opening, True
+                    break
+                new_line += ' ' * (closing + 2 - opening)
+                position = closing + 2
+
+            yield new_line + (blank(line[position:]) if in_comment else line[position:])
+    
+    def add_header_row(pl1_text, default_header_name='RECORDID'):
+        '''
+        Add header row in place of the first level-1 line. Lines are only held back until that line is found; if there 
+        is none, the default header replaces the first line.
+        '''
+
+        def find_header_name(line):
+            if (search_result := PATTERNS['header_row'].search(line)):
+                begin_match, end_match = search_result.span()
+                new_line = line[begin_match:end_match]
+                matches = PATTERNS['digits'].findall(new_line)
+                if len(matches) == 1 and int(matches[0]) == 1:
+                    if (new_search := PATTERNS['header_name'].search(new_line)):
+                        new_beg_match, new_end_match = new_search.span()
+                        return new_line[new_beg_match+1:new_end_match-1] # remove single spaces on edges
+            return None
+
+        def generate_header_row(header_name):
+            header_row = '01 ' + header_name + '.'
+            seven_spaces = ' ' * 7 # seven spaces bc copybooks don't read first seven chars
+            return seven_spaces + header_row
+        
+        pl1_text = iter(pl1_text)
+        held_lines = []
+        for line in pl1_text:
+            if (header_name := find_header_name(line)):
+                yield from held_lines
+                yield generate_header_row(header_name)
+                yield from pl1_text
+                return
+            held_lines.append(line)
+
+        held_lines[0] = generate_header_row(default_header_name)
+        if report is not None:
+            report.add('remove_comments_and_add_header', 'default_header', 
+                       f'No level 1 declaration was found, so the header row is named {default_header_name}.', 0, 
+                       severity='warning', source=True)
+        yield from held_lines
+    
+    
+    
+    # MAIN PROCESS:
+    new_text = remove_leading_comments(pl1_text)
+    new_text = remove_remaining_comments(new_text)
+    new_text = add_header_row(new_text)
+    
+    return new_text if stream else list(new_text)
+
+
+# GENERAL FORMATTING
+def general_formatting(pl1_text, stream=False):
+    '''
+    Performs general formatting such as removing text to the right of the PL1 comma, globally replacing PL1 
+    underscores ('_') with dashes ('-'), and inserting correct left-indentation to each row according to its 
+    level number.
+    '''
+    
+
+    def remove_text_after_pl1_comma_and_replace_underscores(pl1_text):
+        '''
+        First, strips away any remaining text after the 72nd character, so each line is a maximum of 72 chars, then 
+        strips away all unnecessary information to the right of the rightmost PL1 comma in the row, and globally 
+        replaces any PL1 underscores ('_') with COBOL dashes ('-').
+        '''
+        
+        for line in pl1_text:
+            line = line[:72] # strip away any txt after 72nd character
+            if '_' in line:
+                line = line.replace('_', '-') # global replacement
+            # Only the first two commas matter, so stop looking after the second rather than counting them all:
+            if (first_position := line.find(',')) >= 0:
+                second_position = line.find(',', first_position+1) # ensures it is not the first
+                yield line[:second_position if second_position >= 0 else first_position] + '.'
+            elif (semicolon_pos := line.find(';')) >= 0:
+                yield line[:semicolon_pos] + '.'
+            else:
+                yield line
+    
+    
+    def add_left_formatting(pl1_text):
+        '''
+        Determines the indentation level by the first number in the line, and then adds the correct number of spaces 
+        to match the specified indentation.
+        '''
+
+        def add_left_formatting_helper(line, number_id):
+            '''
+            Each row begins with 7 spaces. Then 2 more spaces are added for each successive indentation level.
+            '''
+            
+            base_spaces = ' ' * 7
+            add_spaces = lambda multiplier: ' ' * multiplier if multiplier > 0 else ''
+            begin_line = line.find(str(number_id))
+            new_line = line[begin_line:]
+            number_of_spaces = 2 * (number_id - 1)
+            new_formatting = base_spaces + add_spaces(number_of_spaces) + '0' # also adds '0' before any lvl no.
+            new_line = new_formatting + new_line
+            return new_line
+
+
+        for line in pl1_text:
+            # A single capture of the first digit after the leading whitespace gives the level number
+            if (search_result := PATTERNS['level_number'].match(line)):
+                yield add_left_formatting_helper(line, int(search_result.group(1)))
+            else:
+                yield line
+    
+    
+    # MAIN PROCESS:
+    new_pl1_text = remove_text_after_pl1_comma_and_replace_underscores(pl1_text)
+    new_pl1_text = add_left_formatting(new_pl1_text)
+    
+    return new_pl1_text if stream else list(new_pl1_text)
+
+
+
+# REPLACE EXPRESSIONS
+def replace_pl1_expressions_and_add_periods(pl1_text, pl1_filename, stream=False, memo=None, report=None, 
+                                            stats=None, layout=None):
+    '''
+    Replaces 'CHAR's with 'PIC X's and 'FIXED's with 'PIC S9's. Also reformats the 'PIC S9()V9() COMP-3' with proper 
+    integers in the parentheses, taking the difference between the two 'FIXED(a,b)' integers 'a' and 'b' and inserting 
+    the result into the 'S9()' parentheses and the value of 'b' into the 'V9()' parentheses.
+    
+    Further, lines that have information continuing onto the next line are identified, stored as 'line_holdover's, 
+    and then checked on the next loop iteration if info has been stored there and combines it with the current line.
+    
+    Also the proper 'COMP-3's and '.'s are appended to the end of each line. Each converted line is yielded split into 
+    a FieldLine, for stage 4 to finish without parsing it again (see split_field_lines()).
+
+    With a GroupMemo passed in as 'memo', groups already converted are looked up in it instead (see replace_groups()). 
+    With a ValidationReport passed in as 'report', a malformed line is recorded in it and passed through unconverted 
+    instead of raising. With a PipelineStats passed in as 'stats', every holdover merged into a line is counted. 
+    With a LayoutWriter passed in as 'layout', each line is added to it as it is converted, along with the storage 
+    length the branch that converted it worked out from its CHAR, FIXED, FIXED BIN or PIC clause.
+    '''
+
+    def report_or_raise(message, rule, line_number):
+        if report is None:
+            raise Exception(message)
+        report.add('replace_pl1_expressions_and_add_periods', rule, message, line_number, source=True)
+    
+    def merge_holdover(line_holdover, line):
+        '''Joins a 'line_holdover' onto the front of the line it continues, counting the merge in 'stats'.'''
+
+        if stats is not None:
+            stats.count_event('holdovers_merged')
+        return line_holdover + ' ' + line.lstrip()
+
+    def lay_out(record_field, line, line_number, usage=None, picture=None, length=None, occurs=None):
+        '''
+        Passes the field on a converted 'line' to 'record_field', with the storage its branch worked out, or a 
+        'length' of None for a group. The OCCURS count is read from the name, as in 'NAME(3)', unless given. A line 
+        with no level number is passed with a level of None, so every line is passed, as every line advances the 
+        counter of increment_field_names().
+        '''
+
+        if (search_result := PATTERNS['layout_entry'].match(line)):
+            level, name, dimension = search_result.groups()
+            occurs = occurs or (int(dimension) if dimension else None)
+            record_field(int(level), name, usage, picture, length, occurs, line_number)
+        else:
+            record_field(None, None, None, None, None, None, line_number)
+
+    def replace_expressions(pl1_text, start=0, holdover_state=None, record_field=None):
+        '''
+        Processes the lines in order, carrying any 'line_holdover' forward onto the next line. With a 'holdover_state' 
+        dict, the holdover is picked up from it and left in it at the end, so consecutive runs over the lines of a 
+        copybook give the same result as a single one. 'start' is the line number of the first line. Each line is 
+        passed to 'record_field', if given, as lay_out() does.
+        '''
+
+        line_holdover = holdover_state['line_holdover'] if holdover_state else None
+        for i, line in enumerate(pl1_text, start):
+
+            if (search_result := PATTERNS['improper_pic'].search(line)):
+                report_or_raise(f'Line {i} in Pl1 copybook {pl1_filename} has an improper format. Please edit it.', 
+                                'improper_pic', i)
+                if record_field:
+                    lay_out(record_field, line, i)
+                yield line
+                line_holdover = None
+                continue
+        
+            # IMMEDIATE REPLACEMENTS/SUBSTITUTIONS
+            line_sub_1 = PATTERNS['char'].sub('PIC X(', line)
+            new_line = PATTERNS['fixed'].sub('PIC S9(', line_sub_1)
+        
+            # FIXED --> PIC S9
+            if (search_result := PATTERNS['pic_s9'].search(new_line)):
+                begin_match, end_match = search_result.span()
+                beginning_of_line = new_line[:end_match]
+                end_of_line = new_line[end_match:]
+            
+                # PARSE COMMA BETWEEN INTS
+                usage, picture, length = 'COMP-3', None, None
+                if (new_search := PATTERNS['precision_scale'].search(end_of_line)):
+                    new_begin_match, new_end_match = new_search.span()
+                    line_to_search = end_of_line[new_begin_match:new_end_match]
+                    comma_pos = line_to_search.find(',')
+                    total_len, decimal_len = line_to_search[:comma_pos], line_to_search[comma_pos+1:]
+                    if total_len and decimal_len:
+                        integer_len = int(total_len) - int(decimal_len)
+                        int_len = int(total_len) if integer_len <= 0 else integer_len
+                        beginning_of_line = beginning_of_line.replace('.', '')
+                        full_new_line = beginning_of_line + f'{int_len})V9({decimal_len}) COMP-3.'
+                        picture = f'S9({int_len})V9({decimal_len})'
+                        length = packed_decimal_length(int_len + int(decimal_len))
+                    else:
+                        report_or_raise('Unknown PICS9/V9 lengths.', 'precision_scale', i)
+                        full_new_line = new_line
+            
+                # NO COMMA BETWEEN INTS
+                else:
+                    new_line = new_line.replace('.', '')
+                    full_new_line = new_line + '  COMP-3.'
+                    if (digits := PATTERNS['digits'].match(end_of_line)):
+                        picture, length = f'S9({digits.group()})', packed_decimal_length(int(digits.group()))
+            
+                # APPEND LINE W/ CHANGES
+                full_new_line = merge_holdover(line_holdover, full_new_line) if line_holdover else full_new_line
+                if record_field:
+                    lay_out(record_field, full_new_line, i, usage, picture, length)
+                yield full_new_line
+                line_holdover = None
+        
+            # FIXED BINARY --> PIC S9 BINARY
+            elif (search_result := PATTERNS['fixed_bin'].search(new_line)):
+                begin_match, end_match = search_result.span()
+                digit_str = PATTERNS['digits'].findall(new_line[begin_match:])[0]
+                digit_int = int(digit_str) if digit_str else None
+                begin_new_line = new_line[:begin_match]
+                picture, length = None, None
+                if (digit_int is not None) and (type(digit_int) == int):
+                    if digit_int == 15:
+                        full_new_line = begin_new_line + 'PIC S9(4)'
+                    elif digit_int == 31:
+                        full_new_line = begin_new_line + 'PIC S9(8)'
+                    elif digit_int == 63:
+                        full_new_line = begin_new_line + 'PIC S9(16)'
+                    else:
+                        report_or_raise('Unknown FIXED BINARY integer value.', 'fixed_bin_width', i)
+                        full_new_line = new_line
+                    if digit_int in FIXED_BINARY_DIGITS:
+                        picture = f'S9({FIXED_BINARY_DIGITS[digit_int]})'
+                        length = binary_length(FIXED_BINARY_DIGITS[digit_int])
+            
+                full_new_line = full_new_line.replace('.', '')
+                full_new_line = full_new_line + ' BINARY.'
+                full_new_line = merge_holdover(line_holdover, full_new_line) if line_holdover else full_new_line
+                if record_field:
+                    lay_out(record_field, full_new_line, i, 'BINARY', picture, length)
+                yield full_new_line
+                line_holdover = None
+        
+            # CHAR --> PIC X
+            elif (search_result := PATTERNS['pic_x'].search(new_line)):
+                full_new_line = new_line + '.' if '.' not in new_line else new_line
+                full_new_line = merge_holdover(line_holdover, full_new_line) if line_holdover else full_new_line
+                if record_field:
+                    digits = PATTERNS['digits'].match(new_line, search_result.end())
+                    lay_out(record_field, full_new_line, i, 'DISPLAY', f'X({digits.group()})' if digits else None, 
+                            int(digits.group()) if digits else None)
+                yield full_new_line
+                line_holdover = None
+        
+            elif (search_result := PATTERNS['pic_any'].search(new_line)):
+                full_new_line = new_line + '.' if '.' not in new_line else new_line
+                full_new_line = merge_holdover(line_holdover, full_new_line) if line_holdover else full_new_line
+                if record_field:
+                    clause = search_result.group().split()
+                    picture = clause[1].rstrip('.') if len(clause) > 1 else None
+                    lay_out(record_field, full_new_line, i, 'DISPLAY', picture, 
+                            storage_length(picture) if picture else None)
+                yield full_new_line
+                line_holdover = None
+
+            # OCCURS CLAUSES
+            elif (search_result := PATTERNS['occurs'].search(new_line)):
+                beg_match, end_match = search_result.span()
+                new_line_2 = new_line[beg_match:end_match]
+                digit_str = PATTERNS['digits'].findall(new_line_2)
+                end_char = new_line.find('(')
+                new_line = new_line.replace('.', '')
+                full_new_line = new_line[:end_char] + f'  OCCURS {digit_str[0]} TIMES.'
+                if record_field:
+                    lay_out(record_field, full_new_line, i, occurs=int(digit_str[0]))
+                yield full_new_line
+                line_holdover = None
+        
+            # SETTING HOLDOVERS (TO BE ADDED IN FRONT OF NEXT LINE)
+            # elif (search_result := re.search('\s+[^\s]+$', new_line)):
+            elif (search_result := PATTERNS['holdover'].search(new_line)):
+                beg_match, end_match = search_result.span()
+
+                # Only set line_holdover if the EOL match is greater than 50 chars, otherwise just append line
+                new_search = PATTERNS['trailing_space'].search(new_line)
+                new_beg_match = new_search.span()[0]
+                line_holdover = new_line[:new_beg_match]
+        
+            # ALL OTHER CASES
+            else:
+                new_line = new_line + '.' if new_line and '.' not in new_line else new_line
+                if record_field:
+                    lay_out(record_field, new_line, i)
+                yield new_line
+                line_holdover = None
+
+        if holdover_state is not None:
+            holdover_state['line_holdover'] = line_holdover
+
+
+    def split_level(line):
+        '''
+        Splits a line indented by add_left_formatting() into its level number and the text after it, so the line can 
+        be rebuilt at any other level. Any other line gives a level of None and the whole line.
+        '''
+
+        if (search_result := PATTERNS['indented_level'].match(line)):
+            level = int(search_result.group(2))
+            if len(search_result.group(1)) == 5 + 2 * level:
+                return level, line[search_result.end():]
+        return None, line
+
+    def indent(level, text):
+        return ' ' * (5 + 2 * level) + '0' + str(level) + text
+
+
+    def replace_groups(pl1_text):
+        '''
+        Converts the lines through 'memo' one group at a time, a group being a line with a level number and every 
+        line after it down to the next one at the same level or above. A group is keyed on its lines with their 
+        levels made relative to its own, so a repeated group is converted once and afterwards only re-indented at 
+        its new level, wherever it sits. A group not found is converted line by line, except for its subgroups, 
+        which are looked up in turn, and then stored whole. Single lines are never looked up, only converted in 
+        runs, and groups longer than memo.max_group_lines are never buffered whole, only their subgroups, so 
+        streaming stays within a bounded number of lines.
+
+        The holdover state is shared by every run of replace_expressions(), so splitting the lines into groups never 
+        changes the result, and a group is only looked up or stored when no holdover runs into or out of it. A group 
+        whose output does not line up with its input one line for one line, because a holdover was merged, or that 
+        went through the OCCURS branch, which copies the level number into the clause, is only reused at the same 
+        level.
+
+        With 'layout', the fields of a group are captured while it is converted and stored with its lines, so a group 
+        reused from 'memo' adds the same fields to 'layout' as converting it again would, at its new level.
+        '''
+
+        holdover_state = {'line_holdover': None}
+        captured_fields = [] # with 'layout', the fields of each group being converted, innermost last
+        items = ((i, line, *split_level(line)) for i, line in enumerate(pl1_text)) # (line number, line, level, text)
+        pushed_back = []
+
+        def next_item():
+            return pushed_back.pop() if pushed_back else next(items, None)
+
+        def count_reported():
+            return len(report.diagnostics) if report is not None else 0
+
+        def record_field(*field):
+            if captured_fields:
+                captured_fields[-1].append(field)
+            else:
+                layout.add(*field)
+
+        def convert_lines(run_items):
+            if not run_items:
+                return []
+            return list(replace_expressions([item[1] for item in run_items], run_items[0][0], holdover_state, 
+                                            record_field if layout is not None else None))
+
+        def convert_group(group_items):
+            '''Converts a group buffered whole, from 'memo' if it was converted before.'''
+
+            level, first_line_number, reported = group_items[0][2], group_items[0][0], count_reported()
+            texts = tuple(item[3] for item in group_items)
+            relative_levels = tuple(item[2] - level if item[2] is not None else None for item in group_items)
+            key = (texts, relative_levels, layout is not None) # only entries with their fields serve a layout
+            reusable = holdover_state['line_holdover'] is None
+            if reusable and (stored_lines := memo.find(key, level)) is not None:
+                relative = stored_lines[0] == 'relative'
+                if layout is not None:
+                    for field_level, *field, line_offset in stored_lines[2]:
+                        field_level = level + field_level if relative and field_level is not None else field_level
+                        record_field(field_level, *field, first_line_number + line_offset)
+                if relative:
+                    return [indent(level + relative_level, text) if relative_level is not None else text 
+                            for relative_level, text in stored_lines[1]]
+                return stored_lines[1]
+
+            if layout is not None:
+                captured_fields.append([])
+
+            # Convert the group line by line, except for subgroups of more than one line, which are looked up:
+            new_lines, run_start, j = [], 0, 1
+            while j < len(group_items):
+                k = j + 1
+                if group_items[j][2] is not None:
+                    while k < len(group_items) and (group_items[k][2] is None or group_items[k][2] > group_items[j][2]):
+                        k += 1
+                    if k - j > 1:
+                        new_lines += convert_lines(group_items[run_start:j])
+                        new_lines += convert_group(group_items[j:k])
+                        run_start = k
+                j = k
+            new_lines += convert_lines(group_items[run_start:])
+            group_fields = captured_fields.pop() if layout is not None else ()
+
+            # A group with a malformed line is not kept, so each copy of it is reported:
+            if reusable and holdover_state['line_holdover'] is None and count_reported() == reported:
+                # Each line indented by level must still begin with the same indentation and level it came in with, 
+                # and so must each of its fields:
+                prefixes = [item[1][:len(item[1]) - len(item[3])] for item in group_items]
+                if (len(new_lines) == len(group_items) and not any(' OCCURS ' in line for line in new_lines) 
+                        and all(map(str.startswith, new_lines, prefixes)) 
+                        and all(field[0] == item[2] for field, item in zip(group_fields, group_items))):
+                    memo.store(key, None, ('relative', tuple(
+                        (relative_level, line[len(prefix):]) 
+                        for relative_level, line, prefix in zip(relative_levels, new_lines, prefixes)), 
+                        tuple((relative_level, *field[1:6], field[6] - first_line_number) 
+                              for relative_level, field in zip(relative_levels, group_fields))))
+                else:
+                    memo.store(key, level, ('absolute', tuple(new_lines), tuple(
+                        (*field[:6], field[6] - first_line_number) for field in group_fields)))
+
+            # The fields go on to the group around this one, or to 'layout' once the outermost group is converted:
+            for field in group_fields:
+                record_field(*field)
+            
+            return new_lines
+
+        def convert_groups(parent_level):
+            '''Converts the groups that follow, until a line at 'parent_level' or above ends the parent group.'''
+
+            run = []
+            while (item := next_item()) is not None:
+                if parent_level is not None and item[2] is not None and item[2] <= parent_level:
+                    pushed_back.append(item)
+                    break
+                
+                # Buffer the group, up to the longest group the memo keeps:
+                group_items, level = [item], item[2]
+                while (item := next_item()) is not None:
+                    if item[2] is not None and (level is None or item[2] <= level):
+                        pushed_back.append(item)
+                        break
+                    group_items.append(item)
+                    if len(group_items) > memo.max_group_lines:
+                        break
+
+                # Lines that are not groups of their own are gathered up to be converted in one run:
+                if len(group_items) == 1 or level is None:
+                    run += group_items
+                    if len(run) > memo.max_group_lines:
+                        yield from convert_lines(run)
+                        run = []
+                    continue
+
+                yield from convert_lines(run)
+                run = []
+                if len(group_items) <= memo.max_group_lines:
+                    yield from convert_group(group_items)
+                    continue
+
+                # Too long to keep whole, so convert its own lines and put the rest back to go through subgroup by 
+                # subgroup:
+                j = next((j for j, item in enumerate(group_items) if j and item[2] is not None), len(group_items))
+                yield from convert_lines(group_items[:j])
+                pushed_back.extend(reversed(group_items[j:]))
+                yield from convert_groups(level)
+
+            yield from convert_lines(run)
+
+        yield from convert_groups(None)
+
+
+    def split_field_lines(pl1_text):
+        '''
+        Splits each converted line once into a FieldLine, which is all stage 4 works on: its indentation and level 
+        number, its name, and the rest of the line. A name ending in the line's period keeps only the period after it, 
+        as stage 4 drops the rest. A name dimensioned in any way other than 'NAME(3)' is malformed.
+        '''
+
+        for i, line in enumerate(pl1_text):
+            if not (search_result := PATTERNS['field_line'].match(line)):
+                yield FieldLine('', None, '', None, line)
+                continue
+
+            prefix, level, name = search_result.groups()
+            clause = line[search_result.end():]
+            if name.endswith('.'):
+                name, clause = name[:-1], '.'
+            occurs = None
+            if (new_search := PATTERNS['hidden_occurs'].fullmatch(name)):
+                if not new_search.group(3):
+                    name, occurs = new_search.group(1), new_search.group(2)
+                elif new_search.group(3)[0] in '0123456789-':
+                    report_or_raise('Non-conforming format dealing with OCCURS clause.', 'hidden_occurs', i)
+            yield FieldLine(prefix, int(level), name, occurs, clause)
+
+
+    # MAIN PROCESS:
+    if memo is not None:
+        new_pl1_text = replace_groups(pl1_text)
+    else:
+        new_pl1_text = replace_expressions(pl1_text, record_field=layout.add if layout is not None else None)
+    if layout is not None:
+        new_pl1_text = finish_layout(new_pl1_text, layout)
+    new_pl1_text = split_field_lines(new_pl1_text)
+
+    return new_pl1_text if stream else list(new_pl1_text)
+
+
+
+
+# FINAL FORMATTING: INCREMENT NAMES, CLEAN UP 'OCCURS' CLAUSES, AND 
+def clean_up_formatting_and_increment_field_names(pl1_text, counter_start, stream=False, stats=None):
+    '''
+    Final formatting step to make sure there are no repeated field/column names, any remaining OCCURS clauses are 
+    properly handled and formatted, and right-pad to 72 chars in length. It works on the FieldLines that 
+    replace_pl1_expressions_and_add_periods() yields, updating them in place, and only builds each line's text once, 
+    to pad it. With a PipelineStats passed in as 'stats', every OCCURS clause moved onto a line of its own is counted.
+
+    With 'stream' set, returns a generator along with a 'counter_state' dict whose 'counter_end' is only filled in 
+    once the generator has been exhausted.
+    '''
+    
+    def increment_field_names(field_lines, counter_start, counter_state):
+        '''
+        Increments a counter and adds its value to the end of each field/column name to ensure there are no 
+        naming repetitions that will cause errors on the masking engine. Lines with no level number are dropped, 
+        though the counter still advances for them.
+        '''
+
+        counter = counter_start if counter_start > 0 else None
+        for field_line in field_lines:
+            if field_line.level is not None:
+                if counter:
+                    field_line.name += '-' + str(counter)
+                    if field_line.clause != '.': # a name followed by the line's period is not padded
+                        field_line.clause = ' ' * (3 - len(str(counter))) + field_line.clause
+                elif field_line.occurs:
+                    # Only a numbered name has its dimension moved out, so it is put back as written:
+                    field_line.name, field_line.occurs = f'{field_line.name}({field_line.occurs})', None
+                yield field_line
+            counter = counter + 1 if counter is not None else None
+        counter_state['counter_end'] = counter if counter is not None else 0
+
+    
+    def clean_up_remaining_occurs_clauses(field_lines):
+        '''
+        Handles any 'hidden' OCCURS clause, a dimension that was at the end of a field name. The dimension is blanked 
+        out of the line, along with its last character, and a new line with the continuing 'OCCURS X TIMES' clause 
+        is added after it, indented to where the dimension ended.
+        '''
+        
+        for field_line in field_lines:
+            if not (digit_str := field_line.occurs):
+                yield field_line
+                continue
+
+            if stats is not None:
+                stats.count_event('occurs_rewritten')
+            # The dimension came before the counter, so the new line is indented past both:
+            total_chars = len(field_line.prefix) + len(field_line.name) + len(digit_str) + 2
+            field_line.clause = ' ' * (len(digit_str) + 3) + field_line.clause[:-1]
+            yield field_line
+            yield FieldLine(' ' * total_chars, None, '', None, f'OCCURS {digit_str} TIMES.')
+
+    
+    def right_pad(field_lines):
+        '''
+        Pads every row to 72 characters. If there are rows longer than 72 chars, the last block of text containing 
+        storage information and lengths is added as a new row beneath the original one. Only such a row is searched 
+        for its PIC clause.
+        '''
+        
+        for field_line in field_lines:
+            line = field_line.prefix + field_line.name + field_line.clause
+            if len(line) <= 72:
+                yield line.ljust(72)
+            elif (search := PATTERNS['pic_clause'].search(line)):
+                begin_match, end_match = search.span()
+                yield line[:begin_match].ljust(72)
+                yield line[begin_match:].rjust(72)
+    
+    
+    
+    # MAIN PROCESS:
+    counter_state = {'counter_end': 0}
+    new_pl1_text = increment_field_names(pl1_text, counter_start, counter_state)
+    new_pl1_text = clean_up_remaining_occurs_clauses(new_pl1_text)
+    new_pl1_text = right_pad(new_pl1_text)
+    if stream:
+        return new_pl1_text, counter_state
+
+    new_pl1_text = list(new_pl1_text)
+    
+    return new_pl1_text, counter_state['counter_end']
+
+
+
+
+# STRUCTURED PARSING: TOKENIZING PL1 DECLARATIONS INTO A TREE AND EMITTING COBOL FROM IT
+FIXED_BINARY_DIGITS = {15: 4, 31: 8, 63: 16} # FIXED BIN precision --> number of digits in the PIC S9() BINARY
+UNSUPPORTED_ATTRIBUTES = {'BIT', 'FLOAT', 'VAR', 'VARYING', 'POINTER', 'PTR', 'GRAPHIC', 'WIDECHAR', 'AREA', 'OFFSET'}
+CLAUSE_COLUMN = 35 # column the PIC/OCCURS clauses are aligned to, when the level and name leave room for them
+
+
+class DeclarationError(Exception):
+    '''
+    Raised by the structured path for a declaration it cannot convert, naming the 'rule' it broke and the 
+    'line_number' of the source it was found on, so a ValidationReport can record it and the parse carry on.
+    '''
+
+    def __init__(self, message, rule, line_number):
+        super().__init__(message)
+        self.rule, self.line_number = rule, line_number
+
+    def report_to(self, report, stage):
+        report.add(stage, self.rule, str(self), self.line_number - 1, source=True)
 
 
-# READ/STORE FILES
-def read_open_pl1_and_cobol_files(filename):
-    filepath = os.path.join('./', filename)
-    with open(filepath, 'r') as f:
-        file_text_list = f.readlines()
+class Declaration:
+    '''
+    One node of the declaration tree: a single level/name entry of a DCL structure. 'data_type' is 'CHAR', 'FIXED', 
+    'FIXED BIN' or 'PIC', or None for a group, with 'precision' and 'scale' as declared (or the Pl1 defaults). 
+    'dimension' is the number of array elements if the name was dimensioned, and 'attributes' holds any other 
+    attribute keywords. Each node points to its 'parent'; 'children' is only filled in by build_declaration_tree().
+    '''
 
-    return file_text_list
+    __slots__ = ('level', 'name', 'data_type', 'precision', 'scale', 'picture', 'dimension', 'attributes', 
+                 'line_number', 'parent', 'children')
 
+    def __init__(self, level, name, line_number, parent=None):
+        self.level, self.name, self.line_number, self.parent = level, name, line_number, parent
+        self.data_type = self.precision = self.scale = self.picture = self.dimension = self.children = None
+        self.attributes = ()
 
+    def __repr__(self):
+        return f'Declaration({self.level}, {self.name!r}, {self.data_type!r}, {self.precision}, {self.scale})'
 
-# INITIAL FORMATTING
-def remove_comments_and_add_header(pl1_text):
-    '''Bundles and processes three basic initial functions.'''
 
-    def remove_leading_comments(pl1_text, re_exp='\/\*+\/'):
-        '''Remove leading comments at top of file.'''
-        
-        comment_counter, beg_line, end_line = 0, 0, 0
-        for i, line in enumerate(pl1_text):
-            if re.search(re_exp, line):
-                comment_counter += 1
-                if comment_counter == 1:
-                    beg_line = i
-                elif comment_counter == 2:
-                    end_line = i
-                    break
+def tokenize_pl1(pl1_text):
+    '''
+    Splits Pl1 source lines into (kind, value, line_number) tokens in a single left-to-right pass, where 'kind' is 
+    'number', 'name', 'string', 'punct' or 'other'. Comments are skipped, including ones that span several lines, and 
+    anything past the 72nd character outside a comment is ignored, as in general_formatting().
+    '''
 
-        pl1_text = pl1_text[:beg_line] + pl1_text[end_line:]
-        return pl1_text
+    in_comment = False
+    for line_number, line in enumerate(pl1_text, 1):
+        pos = 0
+        while True:
+            if in_comment:
+                comment_end = line.find('*/', pos)
+                if comment_end < 0:
+                    break
+                pos, in_comment = comment_end + 2, False
 
-    def remove_remaining_comments(pl1_text, re_exp='\/\*.+\*\/'):
-        '''Remove in-text comments from rest of file.'''
-        
-        new_pl1_text = []
-        for line in pl1_text:
-            if (search_result := re.search(re_exp, line)):
-                begin, end = search_result.span()
-                length = end - begin
-                spaces = ' ' * length
-                new_line = re.sub(re_exp, spaces, line)
-                new_pl1_text.append(new_line)
+            for token in PATTERNS['pl1_token'].finditer(line, pos, 72):
+                kind = token.lastgroup
+                if kind == 'comment':
+                    pos, in_comment = token.end(), True
+                    break
+                elif kind != 'space':
+                    yield kind, token.group(), line_number
             else:
-                new_pl1_text.append(line)
-        return new_pl1_text
-    
-    def add_header_row(pl1_text, default_header_name='RECORDID'):
-        '''Add header row and insert at first index in list.'''
-        
-        header_name, header_line_num = None, 0
-        for i, line in enumerate(pl1_text):
-            if (search_result := re.search('0*1\s+\w+\s*,', line)):
-                begin_match, end_match = search_result.span()
-                new_line = line[begin_match:end_match]
-                matches = re.findall('\d+', new_line)
-                if len(matches) != 1:
-                    continue
-                else:
-                    match = matches[0]
-                    try:
-                        int_value = int(match)
-                        if int_value == 1:
-                            if (new_search := re.search('\s+\w+[\s,]', new_line)):
-                                new_beg_match, new_end_match = new_search.span()
-                                header_name = new_line[new_beg_match+1:new_end_match-1] # remove single spaces on edges
-                                header_line_num = i
-                                break
-                    except:
-                        continue
-            
-        header_name = header_name if header_name else default_header_name
-        header_row = '01 ' + header_name + '.'
-        seven_spaces = ' ' * 7 # seven spaces bc copybooks don't read first seven chars
-        spaced_header_row = seven_spaces + header_row
-        former_header_row = pl1_text.pop(header_line_num)
-        pl1_text.insert(header_line_num, spaced_header_row)
-
-        return pl1_text
-    
-    
-    
-    # MAIN PROCESS:
-    new_text = remove_leading_comments(pl1_text)
-    new_text = remove_remaining_comments(new_text)
-    new_text = add_header_row(new_text)
-    
-    return new_text
+                break
 
 
-# GENERAL FORMATTING
-def general_formatting(pl1_text):
+def parse_declarations(tokens, pl1_filename='<text>', report=None):
     '''
-    Performs general formatting such as removing text to the right of the PL1 comma, globally replacing PL1 
-    underscores ('_') with dashes ('-'), and inserting correct left-indentation to each row according to its 
-    level number.
+    Single-pass parser over the tokens of one or more DCL structures. Yields each Declaration in source order as soon 
+    as its closing ',' or ';' is reached, linked to its parent through the stack of currently open groups, so only 
+    the ancestors of the current entry are ever held onto. Leading 'DCL'/'DECLARE' keywords are optional.
+
+    A malformed entry raises a DeclarationError. With a ValidationReport passed in as 'report', it is recorded there 
+    instead, the rest of the entry is skipped up to its closing ',' or ';', and parsing carries on from the next one.
     '''
-    
 
-    def remove_text_after_pl1_comma_and_replace_underscores(pl1_text):
+    tokens = iter(tokens)
+    lookahead = []
+    last_token = (None, None, None)
+
+    def next_token():
+        nonlocal last_token
+        last_token = lookahead.pop() if lookahead else next(tokens, (None, None, None))
+        return last_token
+
+    def peek_token():
+        if not lookahead:
+            lookahead.append(next(tokens, (None, None, None)))
+        return lookahead[-1]
+
+    def improper_format(line_number, rule='improper_format'):
+        return DeclarationError(f'Line {line_number} in Pl1 copybook {pl1_filename} has an improper format. Please '
+                                + 'edit it.', rule, line_number)
+
+    def skip_rest_of_entry():
         '''
-        First, strips away any remaining text after the 72nd character, so each line is a maximum of 72 chars, then 
-        strips away all unnecessary information to the right of the rightmost PL1 comma in the row, and globally 
-        replaces any PL1 underscores ('_') with COBOL dashes ('-').
+        Reads up to and including the ',' or ';' outside any parentheses that closes the entry being parsed, and 
+        returns it (None at the end). Errors are only raised outside parentheses, so a ',' or ';' just read closed it.
         '''
-        
-        new_pl1_text = []
-        for line in pl1_text:
-            line = line[:72] # strip away any txt after 72nd character
-            line = re.sub('_', '-', line) # global replacement
-            first_position = line.find(',')
-            all_matches = re.findall(',', line)
-            if len(all_matches) == 0:
-                semicolon_pos = line.find(';')
-                if semicolon_pos >= 0:
-                    new_line = line[:semicolon_pos] + '.'
-                    new_pl1_text.append(new_line)
-                else:
-                    new_pl1_text.append(line)
-            elif len(all_matches) == 1:
-                new_line = line[:first_position] + '.'
-                new_pl1_text.append(new_line)
+
+        kind, value, line_number = last_token
+        depth = 0
+        while depth or value not in (',', ';'):
+            kind, value, line_number = next_token()
+            if kind is None:
+                return None
+            if value == '(':
+                depth += 1
+            elif value == ')' and depth:
+                depth -= 1
+        return value
+
+    def parse_arguments(line_number):
+        '''Reads a parenthesized argument list, returning its top-level comma-separated arguments as strings.'''
+
+        next_token() # opening parenthesis
+        arguments, argument, depth = [], '', 1
+        while True:
+            kind, value, token_line_number = next_token()
+            if kind is None:
+                raise improper_format(line_number)
+            if value == '(':
+                depth += 1
+            elif value == ')':
+                depth -= 1
+                if depth == 0:
+                    return arguments + [argument]
+            elif value == ',' and depth == 1:
+                arguments.append(argument)
+                argument = ''
+                continue
+            argument += value
+
+    def parse_integer(argument, line_number, rule='improper_format'):
+        if not argument.isdigit():
+            raise improper_format(line_number, rule)
+        return int(argument)
+
+    def parse_dimension(arguments, line_number):
+        '''Number of elements in a one-dimensional array, declared either as '(n)' or as '(lower:upper)'.'''
+
+        if len(arguments) != 1:
+            raise DeclarationError(f'Line {line_number} in Pl1 copybook {pl1_filename} declares a multi-dimensional '
+                                   + 'array.', 'array_dimension', line_number)
+        lower, colon, upper = arguments[0].rpartition(':')
+        if colon:
+            return parse_integer(upper, line_number) - parse_integer(lower, line_number) + 1
+        return parse_integer(upper, line_number)
+
+    def parse_attributes(declaration):
+        '''Reads attributes up to the closing ',' or ';' and settles the data type, precision and scale.'''
+
+        fixed, base, precision_arguments = False, None, None
+        while True:
+            kind, value, line_number = next_token()
+            if kind == 'punct' and value in ',;':
+                break
+            if kind != 'name':
+                raise improper_format(declaration.line_number if kind is None else line_number)
+
+            keyword = value.upper()
+            arguments = parse_arguments(line_number) if peek_token()[1] == '(' else None
+            if keyword in ('CHAR', 'CHARACTER'):
+                if not arguments or len(arguments) != 1:
+                    raise improper_format(line_number)
+                declaration.data_type, declaration.precision = 'CHAR', parse_integer(arguments[0], line_number)
+            elif keyword in ('FIXED', 'BIN', 'BINARY', 'DEC', 'DECIMAL'):
+                fixed = fixed or keyword == 'FIXED'
+                base = {'BINARY': 'BIN', 'DECIMAL': 'DEC'}.get(keyword, keyword) if keyword != 'FIXED' else base
+                precision_arguments = arguments or precision_arguments
+            elif keyword in ('PIC', 'PICTURE'):
+                kind, value, line_number = next_token()
+                if kind != 'string':
+                    raise improper_format(line_number, 'improper_pic')
+                declaration.data_type, declaration.picture = 'PIC', value[1:-1].replace("''", "'")
+            elif keyword in UNSUPPORTED_ATTRIBUTES:
+                raise DeclarationError(f'Line {line_number} in Pl1 copybook {pl1_filename} uses the {keyword} '
+                                       + 'attribute, which has no COBOL equivalent.', 'unsupported_attribute', 
+                                       line_number)
             else:
-                second_position = line.find(',', first_position+1) # ensures it is not the first
-                new_line = line[:second_position] + '.'
-                new_pl1_text.append(new_line)
+                declaration.attributes += (keyword,)
+
+        # FIXED BIN(p) and FIXED DEC(p,q), or FIXED(p,q), with the Pl1 defaults where no precision is given:
+        if base == 'BIN':
+            declaration.data_type = 'FIXED BIN'
+            declaration.precision = (parse_integer(precision_arguments[0], line_number, 'fixed_bin_width') 
+                                     if precision_arguments else 15)
+        elif fixed or base == 'DEC':
+            precision_arguments = precision_arguments or ['5']
+            if len(precision_arguments) > 2:
+                raise improper_format(line_number, 'precision_scale')
+            declaration.data_type = 'FIXED'
+            declaration.precision = parse_integer(precision_arguments[0], line_number, 'precision_scale')
+            declaration.scale = (parse_integer(precision_arguments[1], line_number, 'precision_scale') 
+                                 if len(precision_arguments) > 1 else 0)
+
+        return value
+
+    def parse_entry(kind, value, line_number):
+        '''Parses one entry from its first token, returning its Declaration and the ',' or ';' that closed it.'''
+
+        if kind != 'number':
+            raise improper_format(line_number)
+
+        # LEVEL AND NAME, WITH AN OPTIONAL DIMENSION
+        level = int(value)
+        kind, name, name_line_number = next_token()
+        if kind != 'name':
+            raise improper_format(line_number if kind is None else name_line_number)
+        while open_declarations and open_declarations[-1].level >= level:
+            open_declarations.pop()
+        parent = open_declarations[-1] if open_declarations else None
+        declaration = Declaration(level, name, line_number, parent)
+        if peek_token()[1] == '(':
+            declaration.dimension = parse_dimension(parse_arguments(line_number), line_number)
+
+        # ATTRIBUTES, UP TO THE ',' THAT CONTINUES THE STRUCTURE OR THE ';' THAT ENDS IT
+        return declaration, parse_attributes(declaration)
+
+    open_declarations = []
+    while True:
+        kind, value, line_number = next_token()
+        if kind is None:
+            return
+        if kind == 'name' and value.upper() in ('DCL', 'DECLARE'):
+            continue
+
+        try:
+            declaration, terminator = parse_entry(kind, value, line_number)
+        except DeclarationError as error:
+            if report is None:
+                raise
+            error.report_to(report, 'parse_declarations')
+            if (terminator := skip_rest_of_entry()) is None:
+                return
+        else:
+            open_declarations.append(declaration)
+            yield declaration
+        if terminator == ';':
+            open_declarations.clear()
 
-        return new_pl1_text
-    
-    
-    def add_left_formatting(pl1_text):
-        '''
-        Determines the indentation level by the first number in the line, and then adds the correct number of spaces 
-        to match the specified indentation.
-        '''
 
-        def add_left_formatting_helper(line, number_id):
-            '''
-            Each row begins with 7 spaces. Then 2 more spaces are added for each successive indentation level.
-            '''
-            
-            base_spaces = ' ' * 7
-            add_spaces = lambda multiplier: ' ' * multiplier if multiplier > 0 else ''
-            begin_line = line.find(str(number_id))
-            new_line = line[begin_line:]
-            number_of_spaces = 2 * (number_id - 1)
-            new_formatting = base_spaces + add_spaces(number_of_spaces) + '0' # also adds '0' before any lvl no.
-            new_line = new_formatting + new_line
-            return new_line
+def build_declaration_tree(pl1_text, pl1_filename='<text>'):
+    '''Parses Pl1 source lines and returns the top-level Declarations, with every 'children' list filled in.'''
 
+    roots = []
+    for declaration in parse_declarations(tokenize_pl1(pl1_text), pl1_filename):
+        declaration.children = []
+        if declaration.parent is None:
+            roots.append(declaration)
+        else:
+            declaration.parent.children.append(declaration)
 
-        new_pl1_text = []
-        for line in pl1_text:
-            if re.search('^\s+1', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 1))
-            elif re.search('^\s+2', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 2))
-            elif re.search('^\s+3', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 3))
-            elif re.search('^\s+4', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 4))
-            elif re.search('^\s+5', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 5))
-            elif re.search('^\s+6', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 6))
-            elif re.search('^\s+7', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 7))
-            elif re.search('^\s+8', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 8))
-            elif re.search('^\s+9', line):
-                new_pl1_text.append(add_left_formatting_helper(line, 9))
-            else:
-                new_pl1_text.append(line)
-                
-        return new_pl1_text
-    
-    
-    # MAIN PROCESS:
-    new_pl1_text = remove_text_after_pl1_comma_and_replace_underscores(pl1_text)
-    new_pl1_text = add_left_formatting(new_pl1_text)
-    
-    return new_pl1_text
+    return roots
 
 
 
-# REPLACE EXPRESSIONS
-def replace_pl1_expressions_and_add_periods(pl1_text, pl1_filename):
+
+# FIELD RECORDS: COMPACT COBOL FIELDS THAT STAGES UPDATE IN PLACE BEFORE THEY ARE RENDERED ONCE
+class FieldRecord:
     '''
-    Replaces 'CHAR's with 'PIC X's and 'FIXED's with 'PIC S9's. Also reformats the 'PIC S9()V9() COMP-3' with proper 
-    integers in the parentheses, taking the difference between the two 'FIXED(a,b)' integers 'a' and 'b' and inserting 
-    the result into the 'S9()' parentheses and the value of 'b' into the 'V9()' parentheses.
-    
-    Further, lines that have information continuing onto the next line are identified, stored as 'line_holdover's, 
-    and then checked on the next loop iteration if info has been stored there and combines it with the current line.
-    
-    Also the proper 'COMP-3's and '.'s are appended to the end of each line.
+    Compact record of one COBOL field. 'picture' is the PIC string without the 'PIC ' (None for a group), 'usage' is 
+    'COMP-3', 'BINARY' or None for DISPLAY, 'occurs' is the OCCURS count if any, 'length' is the bytes of storage one 
+    occurrence takes up (None for a group), and 'line_number' is the line of the Pl1 source the field was declared on. 
+    With __slots__, each record costs a fraction of its rendered 72-character line, and later stages update its 
+    attributes directly rather than re-parsing any text.
     '''
-    
-    line_holdover = None
-    new_pl1_text = []
-    for i, line in enumerate(pl1_text):
 
-        if (search_result := re.search("\s+PIC\s*[XS]*9*['(]\d+[')]", line)):
-            raise Exception(f'Line {i} in Pl1 copybook {pl1_filename} has an improper format. Please edit it.')
-        
-        # IMMEDIATE REPLACEMENTS/SUBSTITUTIONS
-        line_sub_1 = re.sub('\sCHAR\s*\(', 'PIC X(', line)
-        new_line = re.sub('\sFIXED\s*\(', 'PIC S9(', line_sub_1)
-        
-        # FIXED --> PIC S9
-        if (search_result := re.search('\sPIC S9\(', new_line)):
-            begin_match, end_match = search_result.span()
-            beginning_of_line = new_line[:end_match]
-            end_of_line = new_line[end_match:]
-            
-            # PARSE COMMA BETWEEN INTS
-            if (new_search := re.search('\d+,\d+', end_of_line)):
-                new_begin_match, new_end_match = new_search.span()
-                line_to_search = end_of_line[new_begin_match:new_end_match]
-                comma_pos = line_to_search.find(',')
-                total_len, decimal_len = line_to_search[:comma_pos], line_to_search[comma_pos+1:]
-                if total_len and decimal_len:
-                    integer_len = int(total_len) - int(decimal_len)
-                    int_len = int(total_len) if integer_len <= 0 else integer_len
-                    beginning_of_line = re.sub('\.', '', beginning_of_line)
-                    full_new_line = beginning_of_line + f'{int_len})V9({decimal_len}) COMP-3.'
-                else:
-                    raise Exception('Unknown PICS9/V9 lengths.')
-            
-            # NO COMMA BETWEEN INTS
+    __slots__ = ('level', 'name', 'picture', 'usage', 'occurs', 'length', 'line_number')
+
+    def __init__(self, level, name, picture=None, usage=None, occurs=None, length=None, line_number=None):
+        self.level, self.name, self.picture, self.usage = level, name, picture, usage
+        self.occurs, self.length, self.line_number = occurs, length, line_number
+
+    def __repr__(self):
+        return f'FieldRecord({self.level}, {self.name!r}, {self.picture!r}, {self.usage!r}, {self.occurs})'
+
+
+class FieldLine:
+    '''
+    Compact record of one line of the heuristic path, as replace_pl1_expressions_and_add_periods() converted it: 
+    'prefix' is its indentation and level number with the spaces after it, 'name' the field name as written, and 
+    'clause' the rest of the line, kept as written so the source columns survive. A dimension at the end of the name, 
+    as in 'NAME(3)', is taken off it into 'occurs', the digits as written. A line with no level number has a 'level' 
+    of None, an empty prefix and name, and the whole line as its clause. Stage 4 updates the name and clause in place, 
+    and the line is only put back together once, when it is padded to 72 characters.
+    '''
+
+    __slots__ = ('prefix', 'level', 'name', 'occurs', 'clause')
+
+    def __init__(self, prefix, level, name, occurs, clause):
+        self.prefix, self.level, self.name, self.occurs, self.clause = prefix, level, name, occurs, clause
+
+    def __repr__(self):
+        return f'FieldLine({self.prefix!r}, {self.level}, {self.name!r}, {self.occurs!r}, {self.clause!r})'
+
+
+def build_field_records(declarations, pl1_filename='<text>', report=None):
+    '''
+    Translates each parsed Declaration into a FieldRecord with its COBOL name, picture, usage, OCCURS count and storage 
+    length, worked out from the declaration's precision and scale. One that has no COBOL equivalent raises a 
+    DeclarationError, or with a ValidationReport passed in as 'report', is recorded there and yielded as it stands.
+    '''
+
+    def report_or_raise(error):
+        if report is None:
+            raise error
+        error.report_to(report, 'build_field_records')
+
+    for declaration in declarations:
+        if not 0 < declaration.level < 50:
+            report_or_raise(DeclarationError(f'Line {declaration.line_number} in Pl1 copybook {pl1_filename} has level '
+                                             + f'number {declaration.level}, outside the COBOL range of 01 to 49.', 
+                                             'level_range', declaration.line_number))
+
+        field_record = FieldRecord(declaration.level, declaration.name.replace('_', '-'), 
+                                   occurs=declaration.dimension, line_number=declaration.line_number)
+        if declaration.data_type == 'CHAR':
+            field_record.picture, field_record.length = f'X({declaration.precision})', declaration.precision
+        elif declaration.data_type == 'FIXED':
+            integer_len = declaration.precision - declaration.scale
+            int_len = declaration.precision if integer_len <= 0 else integer_len
+            decimal_picture = f'V9({declaration.scale})' if declaration.scale else ''
+            field_record.picture, field_record.usage = f'S9({int_len}){decimal_picture}', 'COMP-3'
+            field_record.length = packed_decimal_length(int_len + declaration.scale)
+        elif declaration.data_type == 'FIXED BIN':
+            if declaration.precision in FIXED_BINARY_DIGITS:
+                field_record.picture = f'S9({FIXED_BINARY_DIGITS[declaration.precision]})'
+                field_record.usage = 'BINARY'
+                field_record.length = binary_length(FIXED_BINARY_DIGITS[declaration.precision])
             else:
-                new_line = re.sub('\.', '', new_line)
-                full_new_line = new_line + '  COMP-3.'
-            
-            # APPEND LINE W/ CHANGES
-            full_new_line = line_holdover + ' ' + full_new_line.lstrip() if line_holdover else full_new_line
-            new_pl1_text.append(full_new_line)
-            line_holdover = None
-        
-        # FIXED BINARY --> PIC S9 BINARY
-        elif (search_result := re.search('\sFIXED BIN\s?\(\d+\)', new_line)):
-            begin_match, end_match = search_result.span()
-            digit_str = re.findall('\d+', new_line[begin_match:])[0]
-            digit_int = int(digit_str) if digit_str else None
-            begin_new_line = new_line[:begin_match]
-            if (digit_int is not None) and (type(digit_int) == int):
-                if digit_int == 15:
-                    full_new_line = begin_new_line + 'PIC S9(4)'
-                elif digit_int == 31:
-                    full_new_line = begin_new_line + 'PIC S9(8)'
-                elif digit_int == 63:
-                    full_new_line = begin_new_line + 'PIC S9(16)'
-                else:
-                    raise Exception('Unknown FIXED BINARY integer value.')
-            
-            full_new_line = re.sub('\.', '', full_new_line)
-            full_new_line = full_new_line + ' BINARY.'
-            full_new_line = line_holdover + ' ' + full_new_line.lstrip() if line_holdover else full_new_line
-            new_pl1_text.append(full_new_line)
-            line_holdover = None
-        
-        # CHAR --> PIC X
-        elif (search_result := re.search('\sPIC X\(', new_line)):
-            full_new_line = new_line + '.' if re.search('\.', new_line) is None else new_line
-            full_new_line = line_holdover + ' ' + full_new_line.lstrip() if line_holdover else full_new_line
-            new_pl1_text.append(full_new_line)
-            line_holdover = None
-        
-        elif (search_result := re.search('\sPIC.+$', new_line)):
-            full_new_line = new_line + '.' if re.search('\.', new_line) is None else new_line
-            full_new_line = line_holdover + ' ' + full_new_line.lstrip() if line_holdover else full_new_line
-            new_pl1_text.append(full_new_line)
-            line_holdover = None
-
-        # OCCURS CLAUSES
-        elif (search_result := re.search('\d+\s+\w+\(\d+\)\s+$', new_line)):
-            beg_match, end_match = search_result.span()
-            new_line_2 = new_line[beg_match:end_match]
-            digit_str = re.findall('\d+', new_line_2)
-            end_char = re.search('\(', new_line).span()[0]
-            new_line = re.sub('\.', '', new_line)
-            full_new_line = new_line[:end_char] + f'  OCCURS {digit_str[0]} TIMES.'
-            new_pl1_text.append(full_new_line)
-            line_holdover = None
-        
-        # SETTING HOLDOVERS (TO BE ADDED IN FRONT OF NEXT LINE)
-        # elif (search_result := re.search('\s+[^\s]+$', new_line)):
-        elif (search_result := re.search('\w+[^\.]\s*$', new_line)):
-            beg_match, end_match = search_result.span()
-
-            # Only set line_holdover if the EOL match is greater than 50 chars, otherwise just append line
-            new_search = re.search('\s+$', new_line)
-            new_beg_match = new_search.span()[0]
-            line_holdover = new_line[:new_beg_match]
-        
-        # ALL OTHER CASES
+                report_or_raise(DeclarationError(f'Line {declaration.line_number} in Pl1 copybook {pl1_filename} has '
+                                                 + 'an unknown FIXED BINARY integer value.', 'fixed_bin_width', 
+                                                 declaration.line_number))
+        elif declaration.data_type == 'PIC':
+            # Pl1 repetition factors come before the picture character, COBOL ones after: '(5)9' --> '9(5)'
+            field_record.picture = PATTERNS['pl1_picture_repeat'].sub(r'\2(\1)', declaration.picture)
+            field_record.length = storage_length(field_record.picture)
+
+        yield field_record
+
+
+def number_field_records(field_records, counter_start, counter_state):
+    '''
+    Appends the counter to each field name in place, as increment_field_names() does for the heuristic path. The 
+    counter advances once per field, and 'counter_state' holds 'counter_end' once the generator is exhausted.
+    '''
+
+    counter = counter_start if counter_start > 0 else None
+    for field_record in field_records:
+        if counter:
+            field_record.name = f'{field_record.name}-{counter}'
+            counter += 1
+        yield field_record
+    counter_state['counter_end'] = counter if counter is not None else 0
+
+
+def render_field_records(field_records, pl1_filename='<text>', report=None):
+    '''
+    Renders each FieldRecord as 72-character COBOL text, the only point at which any text is built: indented by level 
+    as in add_left_formatting(), with its PIC, usage and OCCURS clauses aligned to CLAUSE_COLUMN. A clause that does 
+    not fit is moved onto its own right-aligned line, as in right_pad(). A field that cannot fit even then raises, or 
+    with a ValidationReport passed in as 'report', is recorded there and rendered cut to 72 characters.
+    '''
+
+    for field_record in field_records:
+        indent = ' ' * (7 + 2 * (field_record.level - 1))
+        entry = f'{indent}{field_record.level:02d} {field_record.name}'
+        clauses = []
+        if field_record.picture:
+            clauses.append('PIC ' + field_record.picture)
+        if field_record.usage:
+            clauses.append(field_record.usage)
+        if field_record.occurs:
+            clauses.append(f'OCCURS {field_record.occurs} TIMES')
+        clause = ' '.join(clauses)
+        new_line = entry.ljust(CLAUSE_COLUMN - 1) + ' ' + clause + '.' if clause else entry + '.'
+
+        if len(new_line) <= 72:
+            yield new_line.ljust(72)
+        elif len(entry) <= 72 and len(clause) < 72:
+            yield entry.ljust(72)
+            yield (clause + '.').rjust(72)
         else:
-            new_line = new_line + '.' if new_line and re.search('\.', new_line) is None else new_line
-            new_pl1_text.append(new_line)
-            line_holdover = None
-    
-    return new_pl1_text
+            error = DeclarationError(f'Line {field_record.line_number} in Pl1 copybook {pl1_filename} does not fit in '
+                                     + '72 characters.', 'line_length', field_record.line_number)
+            if report is None:
+                raise error
+            error.report_to(report, 'render_field_records')
+            yield new_line[:72]
 
 
 
 
-# FINAL FORMATTING: INCREMENT NAMES, CLEAN UP 'OCCURS' CLAUSES, AND 
-def clean_up_formatting_and_increment_field_names(pl1_text, counter_start):
+# LAYOUT: THE STORAGE OFFSET AND LENGTH OF EVERY FIELD, WRITTEN ALONGSIDE THE .CBL FILE
+LAYOUT_FORMATS = ('json', 'bin')
+LAYOUT_USAGES = ('GROUP', 'DISPLAY', 'COMP-3', 'BINARY') # usage codes of the binary layout, in order
+LAYOUT_MAGIC = b'PLXL'
+LAYOUT_LENGTH_WIDTH = 10 # characters left for a group's length in the JSON layout, patched in once the group closes
+
+def packed_decimal_length(digits):
+    '''Bytes taken up by a COMP-3 field of 'digits' digits: half a byte per digit, plus half a byte for the sign.'''
+
+    return digits // 2 + 1
+
+
+def binary_length(digits):
+    '''Bytes taken up by a BINARY field of 'digits' digits: a halfword, fullword or doubleword.'''
+
+    return 2 if digits <= 4 else 4 if digits <= 9 else 8
+
+
+@functools.lru_cache(maxsize=4096)
+def storage_length(picture, usage=None):
     '''
-    Final formatting step to make sure there are no repeated field/column names, any remaining OCCURS clauses are 
-    properly handled and formatted, and right-pad to 72 chars in length.
+    Bytes taken up by one field of the given PIC string and usage: a byte per character position for DISPLAY, not 
+    counting 'S', 'V' or 'P', and as packed_decimal_length() or binary_length() for COMP-3 or BINARY. A Pl1 picture 
+    the heuristic path left in quotes, such as '(5)9', is read with its repetition factors first. Cached, since a 
+    library spells the same few pictures over and over.
     '''
+
+    if picture.startswith("'"):
+        picture = PATTERNS['pl1_picture_repeat'].sub(r'\2(\1)', picture.strip("'"))
+    picture = PATTERNS['cobol_picture_repeat'].sub(lambda match: match.group(1) * int(match.group(2)), picture.upper())
+    digits = picture.count('9')
+
+    if usage == 'COMP-3':
+        return packed_decimal_length(digits)
+    if usage == 'BINARY':
+        return binary_length(digits)
     
-    def increment_field_names(pl1_text, counter_start):
+    return len(picture) - picture.count('S') - picture.count('V') - picture.count('P')
+
+
+@functools.lru_cache(maxsize=4096)
+def json_picture(picture):
+    '''A picture as JSON, cached like storage_length(), since a library spells the same few pictures over and over.'''
+
+    return json.dumps(picture)
+
+
+def layout_path(cbl_filename, layout_format):
+    return os.path.splitext(cbl_filename)[0] + '.layout.' + layout_format
+
+
+def json_layout_header(cbl_filename):
+    # Everything before the first field of a JSON layout, which never holds a linebreak of its own
+    return ('{"file": ' + json.dumps(cbl_filename) + ', "fields": [').encode()
+
+
+class LayoutWriter:
+    '''
+    Writes the storage layout of one copybook next to its .cbl file, one entry per field in the order the fields are 
+    converted: its level, name, usage ('GROUP' for a group), picture, 'offset' from the start of its 01 record, 
+    'length' of one occurrence, 'occurs' count, and 'multiplier', the number of times it occurs in the record once the 
+    OCCURS counts of its groups are multiplied in. Each field is passed to add() with the storage length the stage 
+    that converted it already worked out, or None for a group.
+
+    An entry is written as soon as its offset is known, so only the groups still open are held in memory. A group's 
+    length is only known once it closes, so it is written as a placeholder and patched in afterwards, in batches. 
+    The entries go to a temporary file that commit() moves into place, so use the writer as a context manager around 
+    the conversion: the layout is only kept if no exception was raised.
+
+    As JSON, the layout is {"file": ..., "fields": [...]} with one field per line. With 'layout_format' set to 'bin', 
+    it takes a compact binary form instead: the 4 bytes of LAYOUT_MAGIC, a 2-byte version and a 4-byte count of 
+    fields, then for each field its level and usage code (an index into LAYOUT_USAGES) as single bytes, its offset, 
+    length, occurs count and multiplier as 4-byte integers, and its name as a 1-byte length and then ASCII. Integers 
+    are little-endian.
+
+    A field with no storage of its own and no fields under it cannot be laid out, so it raises, or with a 
+    ValidationReport passed in as 'report', is recorded there and laid out with a length of 0.
+    '''
+
+    def __init__(self, cbl_filename, layout_format='json', pl1_filename='<text>', report=None):
+        if layout_format not in LAYOUT_FORMATS:
+            raise Exception(f"Unknown layout format '{layout_format}'. Use either 'json' or 'bin'.")
+
+        import struct
+
+        self.struct = struct
+        self.cbl_filename, self.pl1_filename, self.report = cbl_filename, pl1_filename, report
+        self.binary = layout_format == 'bin'
+        self.filepath = layout_path(cbl_filename, layout_format)
+        self.temp_filepath = f'{self.filepath}.{os.getpid()}.tmp'
+        self.counter = None
+        # Each open group is a [level, offset, offset of its next field, multiplier, occurs, position of its length, 
+        # name, line number, whether any field was added under it] list:
+        self.open_groups = []
+        self.patches = [] # (position in the file, length) of the closed groups not yet patched in
+        self.number_of_fields, self.finished = 0, False
+
+        self.file = open(self.temp_filepath, 'w+b')
+        if self.binary:
+            header = struct.pack('<4sHI', LAYOUT_MAGIC, 1, 0)
+        else:
+            header = json_layout_header(cbl_filename)
+        self.file.write(header)
+        self.position = len(header) # tracked by hand, since asking the file would cost a system call per field
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.discard()
+
+    def number_names(self, counter_start):
         '''
-        Increments a counter and adds its value to the end of each field/column name to ensure there are no 
-        naming repetitions that will cause errors on the masking engine.
+        Appends a counter to every name from now on, advancing once per call to add() whether or not it adds a field, 
+        so the names match the ones increment_field_names() gives the lines of the heuristic path.
         '''
 
-        counter = counter_start if counter_start > 0 else None
-        new_pl1_text = []
-        for line in pl1_text:
-            search_result = re.search('^\s+\d{2}\s+[^\s]+', line)
-            if search_result:
-                beg_match, end_match = search_result.span()
-                if line[:end_match][-1] == '.':
-                    if counter:
-                        new_line = line[:end_match-1] + '-' + str(counter) + '.'
-                    else:
-                        new_line = line[:end_match-1] + '.'
-                else:
-                    if counter:
-                        cnt_len = len(str(counter))
-                        add_spaces = ' ' * (3 - cnt_len) if cnt_len < 3 else ''
-                        new_line = line[:end_match] + '-' + str(counter) + add_spaces + line[end_match:]
-                    else:
-                        new_line = line
-                new_pl1_text.append(new_line)
-            counter = counter + 1 if counter is not None else None
-        counter_end = counter if counter is not None else 0
-
-        return new_pl1_text, counter_end
+        self.counter = counter_start if counter_start > 0 else None
 
-    
-    def clean_up_remaining_occurs_clauses(pl1_text):
+    def add(self, level, name, usage, picture, length, occurs, line_number):
         '''
-        Searches for any 'hidden' OCCURS clauses in the form of parentheses containing one or more digits at the 
-        end of a field name. If there is a match, the line is processed so that the parentheses and digits are 
-        removed, and a new line with the continuing 'OCCURS X TIMES' clause is added into the list of lines.
+        Lays out the field at 'level' and writes its entry. A 'length' of None makes it a group, laid out once the 
+        fields under it are. A 'level' of None adds no field at all. 'line_number' is where the field was found, 
+        numbered from 0 as ValidationReport.add() takes it with 'source' set.
         '''
+
+        counter = self.counter
+        if counter is not None:
+            self.counter += 1
+        if level is None:
+            return
+        if counter is not None:
+            name = f'{name}-{counter}'
+
+        open_groups = self.open_groups
+        while open_groups and open_groups[-1][0] >= level:
+            self.close_group()
+        parent = open_groups[-1] if open_groups else None
+        occurs = occurs or 1
+        if parent:
+            parent[8] = True
+            offset, multiplier = parent[2], occurs * parent[3]
+        else:
+            offset, multiplier = 0, occurs
+
+        if length is None:
+            position = self.write_entry(level, name, 'GROUP', None, offset, None, occurs, multiplier)
+            open_groups.append([level, offset, offset, multiplier, occurs, position, name, line_number, False])
+        else:
+            self.write_entry(level, name, usage or 'DISPLAY', picture, offset, length, occurs, multiplier)
+            if parent:
+                parent[2] += length * occurs
+
+    def write_entry(self, level, name, usage, picture, offset, length, occurs, multiplier):
+        '''Writes one entry, with a placeholder if 'length' is None, and returns the position of its length.'''
+
+        if self.binary:
+            name_bytes = name.encode('ascii')
+            entry = self.struct.pack('<BBIIIIB', level, LAYOUT_USAGES.index(usage), offset, length or 0, occurs, 
+                                     multiplier, len(name_bytes)) + name_bytes
+            length_position = self.position + 6
+        else:
+            # json.dumps() escapes anything outside ASCII, so every character is written as one byte:
+            separator = ',\n  ' if self.number_of_fields else '\n  '
+            entry_start = (f'{separator}{{"level": {level}, "name": {json.dumps(name)}, "usage": "{usage}", '
+                           f'"picture": {json_picture(picture)}, "offset": {offset}, "length": ')
+            length_text = length if length is not None else '0'.rjust(LAYOUT_LENGTH_WIDTH)
+            entry = f'{entry_start}{length_text}, "occurs": {occurs}, "multiplier": {multiplier}}}'.encode()
+            length_position = self.position + len(entry_start)
+
+        self.file.write(entry)
+        self.position += len(entry)
+        self.number_of_fields += 1
         
-        new_pl1_text = []
-        for line in pl1_text:
+        return length_position
+
+    def close_group(self):
+        level, offset, next_offset, multiplier, occurs, position, name, line_number, has_fields = self.open_groups.pop()
+        if not has_fields:
+            message = (f'{name} in Pl1 copybook {self.pl1_filename} has no storage of its own and no fields under '
+                       + 'it, so it cannot be laid out.')
+            if self.report is None:
+                raise Exception(message)
+            self.report.add('LayoutWriter', 'no_storage', message, line_number, source=True)
+
+        length = next_offset - offset
+        self.patches.append((position, length))
+        if len(self.patches) >= 4096:
+            self.apply_patches()
+        if self.open_groups:
+            self.open_groups[-1][2] += length * occurs
+
+    def apply_patches(self):
+        for position, length in self.patches:
+            self.file.seek(position)
+            self.file.write(self.struct.pack('<I', length) if self.binary 
+                            else str(length).rjust(LAYOUT_LENGTH_WIDTH).encode())
+        self.file.seek(0, os.SEEK_END)
+        self.patches.clear()
+
+    def finish(self):
+        '''Closes every group still open, once the last field has been added.'''
+
+        while self.open_groups:
+            self.close_group()
+        self.finished = True
+
+    def commit(self):
+        '''Finishes the layout and moves it into place. Returns its filepath.'''
+
+        if not self.finished:
+            self.finish()
+        self.apply_patches()
+        if self.binary:
+            self.file.seek(6)
+            self.file.write(self.struct.pack('<I', self.number_of_fields))
+        else:
+            self.file.write(b'\n]}\n')
+        self.file.close()
+        os.replace(self.temp_filepath, self.filepath)
+        
+        return self.filepath
 
-            # Search for any remaining OCCURS structures inside parentheses following column name
-            if (search_result := re.search('^\s+\d{2,}\s+[\w\-]+\(\d+\)[\d\-]{1,}', line)):
-                beg_match, end_match = search_result.span()
-                total_chars = end_match - beg_match
-                reduced_line = line[:end_match]
-                rest_of_line = line[end_match:]
-
-                # Search for digits within parentheses at end of column name
-                if (new_search := re.search('\(\d+\)[\d\-]{1,}', reduced_line)):
-                    new_beg_match, new_end_match = new_search.span()
-                    new_total_chars = new_end_match - new_beg_match
-
-                    # Get both values: digits w/i parentheses (OCCURS) and digits to right of parenthesis (LINE NUMBER)
-                    values = re.findall('\d+', reduced_line[new_beg_match:new_end_match])
-                    if len(values) != 2:
-                        raise Exception('Non-conforming format dealing with OCCURS clause.')
-                    digit_str, line_num = values[0], values[1]
-
-                    # Build new line that retains the line number and remaining info in line
-                    add_spaces = ' ' * (new_total_chars - len(line_num))
-                    new_line = reduced_line[:new_beg_match] + '-' + str(line_num) + add_spaces + rest_of_line[:-1]
-                    new_pl1_text.append(new_line)
-
-                    # Adds OCCURS clause as additional next line with retained digit_str info
-                    additional_line = (' ' * total_chars) + f'OCCURS {digit_str} TIMES.'
-                    new_pl1_text.append(additional_line)
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_filepath):
+            os.remove(self.temp_filepath)
 
-                else:
-                    new_pl1_text.append(line)
 
-            else:
-                new_pl1_text.append(line)
+def finish_layout(lines, layout):
+    '''Passes the lines straight through, and finishes 'layout' once the last one has been converted.'''
 
-        return new_pl1_text
+    yield from lines
+    layout.finish()
 
-    
-    def right_pad(pl1_text):
-        '''
-        Pads every row to 72 characters. If there are rows longer than 72 chars, the last block of text containing 
-        storage information and lengths is added as a new row beneath the original one.
-        '''
-        
-        new_pl1_text = []
-        for line in pl1_text:
-            new_line = line.ljust(72)
-            if len(new_line) > 72:
-                search = re.search('PIC\s.+$', line)
-                if search:
-                    begin_match, end_match = search.span()
-                    first_line = line[:begin_match].ljust(72)
-                    new_pl1_text.append(first_line)
-                    second_line = line[begin_match:].rjust(72)
-                    new_pl1_text.append(second_line)
-            else:
-                new_pl1_text.append(new_line)
-                
-        return new_pl1_text
-    
-    
-    
-    # MAIN PROCESS:
-    new_pl1_text, counter_end = increment_field_names(pl1_text, counter_start)
-    new_pl1_text = clean_up_remaining_occurs_clauses(new_pl1_text)
-    new_pl1_text = right_pad(new_pl1_text)
-    
-    return new_pl1_text, counter_end
+
+def lay_out_field_records(field_records, layout):
+    '''Passes the FieldRecords straight through, adding each one to 'layout' as it goes by.'''
+
+    for field_record in field_records:
+        layout.add(field_record.level, field_record.name, field_record.usage, field_record.picture, 
+                   field_record.length, field_record.occurs, field_record.line_number - 1)
+        yield field_record
+    layout.finish()
 
 
 
 
 # PREPARE, GENERATE, AND WRITE NEW FILE
-def write_output_to_file(pl1_text, cbl_filename):
+def write_output_to_file(pl1_text, cbl_filename, stream=False, fsync=False, changes=None):
     '''
-    Writes string-type output to file, and then reads in the new file's data to make sure the file text was generated 
-    properly and the file is written without error.
+    Writes string-type output to file, verifying in memory as it goes that every line is 72 characters and that the 
+    number of bytes on disk matches the number of bytes written, so the file never has to be read back in. The output 
+    is written to a temporary file next to 'cbl_filename' and only renamed over it once verified, so a failed run 
+    never leaves a partial or corrupted .cbl behind. With 'fsync' set, the data is flushed to disk before the rename. 
+    Linebreaks and encoding follow the platform, as they would for a file written in text mode.
+
+    Given a 'changes' dict, the output is first compared with the .cbl file already there and only written if it 
+    differs, so an unchanged file keeps its modification time. Whether it was 'new', 'changed' or 'unchanged' is 
+    recorded in 'changes' under 'cbl_filename' (see record_change()). With 'stream' set, the output is still written 
+    to the temporary file, hashed as it goes, and the temporary file is discarded if the output turns out unchanged.
+
+    Returns the output string, or with 'stream' set, writes each line as soon as it arrives and returns the number of 
+    lines written instead.
     '''
 
-    def add_linebreaks_and_generate_string(pl1_text):
+    def add_linebreaks(pl1_text, fail_line_nums_dict):
         '''
-        
+        Confirms each line conforms to the 72 character standard, tallying up the fails in 'fail_line_nums_dict', and 
+        yields it back with a linebreak appended.
         '''
-        new_pl1_text = []
-        fail_line_nums_dict = {}
-        for i, line in enumerate(pl1_text):
 
-            # Confirm each line conforms to 72 character standard, or tally up the number of fails
+        for i, line in enumerate(pl1_text):
             if len(line) != 72:
                 print(f'Line number {i} NOT 72 chars:', line)
                 fail_line_nums_dict[i] = line
-            
-            # Append linebreaks
-            new_line = line + '\n'
-            new_pl1_text.append(new_line)
+            yield line + '\n'
 
+    def check_fail_line_nums(fail_line_nums_dict):
         if len(fail_line_nums_dict) > 0:
             print('Failed line numbers:', list(fail_line_nums_dict.keys()))
             raise Exception(str(len(fail_line_nums_dict)) + ' lines have more or less than 72 characters.')
 
-        final_output = ''.join(new_pl1_text)
+    def add_linebreaks_and_generate_string(pl1_text):
+        '''
+        Generates the whole file output string, raising if any line is not exactly 72 characters. The lengths of all 
+        lines are checked in one pass first, so a valid file is joined in one go, and only an invalid one is walked 
+        line by line to report which lines failed.
+        '''
+
+        if isinstance(pl1_text, list) and set(map(len, pl1_text)) == {72}:
+            return '\n'.join(pl1_text) + '\n'
+
+        fail_line_nums_dict = {}
+        final_output = ''.join(add_linebreaks(pl1_text, fail_line_nums_dict))
+        check_fail_line_nums(fail_line_nums_dict)
 
         return final_output
 
+    def encode(output_str):
+        '''
+        Encodes the output just as a file opened in text mode would write it, with each '\n' turned into the 
+        platform's own linebreak, so the bytes can be counted and hashed exactly as they land on disk.
+        '''
+
+        if os.linesep != '\n':
+            output_str = output_str.replace('\n', os.linesep)
+        return output_str.encode(encoding)
+
+    def write_and_verify(output_strs, filepath, compare=False):
+        '''
+        Writes each string to a temporary file, encoded as encode() does, confirms the size on disk equals the bytes 
+        written, then renames the temporary file over 'filepath'. With 'compare' set, the bytes are hashed as they 
+        are written, and the temporary file is removed instead if record_change() finds 'filepath' already holds the 
+        same output.
+        '''
+
+        import hashlib
+
+        temp_filepath = f'{filepath}.{os.getpid()}.tmp'
+        hash_object = hashlib.sha256() if compare else None
+        try:
+            with open(temp_filepath, 'wb') as file_to_write:
+                bytes_written = 0
+                for output_str in output_strs:
+                    output_bytes = encode(output_str)
+                    bytes_written += file_to_write.write(output_bytes)
+                    if hash_object:
+                        hash_object.update(output_bytes)
+                file_to_write.flush()
+                needs_writing = not compare or record_change(filepath, bytes_written, hash_object.hexdigest)
+                if fsync and needs_writing:
+                    os.fsync(file_to_write.fileno())
+                bytes_on_disk = os.fstat(file_to_write.fileno()).st_size
+            if bytes_on_disk != bytes_written:
+                raise Exception(f'Only {bytes_on_disk} of {bytes_written} bytes were written to {filepath}.')
+            if needs_writing:
+                os.replace(temp_filepath, filepath)
+            else:
+                os.remove(temp_filepath)
+        except:
+            if os.path.exists(temp_filepath):
+                os.remove(temp_filepath)
+            raise
+
+        # Also flush the directory entry of the rename, where the platform supports it:
+        if fsync and needs_writing and hasattr(os, 'O_DIRECTORY'):
+            dir_fd = os.open(os.path.dirname(filepath), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    def record_change(filepath, output_size, output_sha256):
+        '''
+        Records in 'changes' whether the output is 'new', 'changed', or 'unchanged' from the file at 'filepath', 
+        comparing their sizes first and only hashing the file, and calling 'output_sha256' for the output's own hash, 
+        when the sizes match. Returns whether the file needs writing.
+        '''
+
+        try:
+            existing_size = os.path.getsize(filepath)
+        except FileNotFoundError:
+            changes[cbl_filename] = 'new'
+            return True
+        unchanged = existing_size == output_size and file_sha256(filepath) == output_sha256()
+        changes[cbl_filename] = 'unchanged' if unchanged else 'changed'
+        
+        return not unchanged
+
+    filepath = os.path.join('./', cbl_filename)
+    encoding = locale.getpreferredencoding(False)
+
+    # Stream lines to file as they are generated, checking all lines before the file is put in place:
+    if stream:
+        fail_line_nums_dict, lines_written = {}, 0
+
+        def count_and_check_lines(pl1_text):
+            nonlocal lines_written
+            for new_line in add_linebreaks(pl1_text, fail_line_nums_dict):
+                lines_written += 1
+                yield new_line
+            check_fail_line_nums(fail_line_nums_dict)
+
+        write_and_verify(count_and_check_lines(pl1_text), filepath, compare=changes is not None)
+
+        return lines_written
 
     # Generate file output string:
     file_output_str = add_linebreaks_and_generate_string(pl1_text)
 
+    # Leave the file untouched if it already holds exactly this output:
+    if changes is not None:
+        import hashlib
+
+        output_bytes = encode(file_output_str)
+        if not record_change(filepath, len(output_bytes), lambda: hashlib.sha256(output_bytes).hexdigest()):
+            return file_output_str
+
     # Write file with output str:
-    filepath = os.path.join('./', cbl_filename)
-    with open(filepath, 'w') as file_to_write:
-        file_to_write.write(file_output_str)
+    write_and_verify([file_output_str], filepath)
     
-    # Retrieve and return file for confirmation:
-    with open(filepath, 'r') as confirm_file:
-        file_text_confirmation = confirm_file.readlines()
+    return file_output_str
+
+
+def summarize_changes(changes):
+    '''
+    Groups the .cbl files that write_output_to_file() recorded in 'changes' into lists of the 'changed', 'new' and 
+    'unchanged' ones, each in the order they were converted, so a downstream build can rebuild only the first two.
+    '''
+
+    summary = {'changed': [], 'new': [], 'unchanged': []}
+    for cbl_filename, change in changes.items():
+        summary[change].append(cbl_filename)
     
-    return file_text_confirmation
+    return summary
 
 
 
 
+# COMMAND LINE: THE OPTIONS THE SCRIPT ACCEPTS AND THE VALUES EACH ONE TAKES
+# Each option maps to what its value must be: None for a flag that takes no value, an int or float for a number no 
+# smaller than it, a tuple of the only values allowed, or str for any non-empty text. Options in 
+# OPTIONAL_VALUE_OPTIONS may also be passed with no value, e.g. "--memo" as well as "--memo=100".
+COMMAND_LINE_OPTIONS = {'stream': None, 'parallel': None, 'processes': 1, 'fsync': None, 'cache-dir': str, 
+                        'cache-size': 0, 'clear-cache': None, 'parser': ('heuristic', 'structured'), 'watch': str, 
+                        'watch-glob': str, 'interval': 0.0, 'mmap': None, 'serve': str, 'concurrency': 0, 
+                        'queue-size': 0, 'manifest': str, 'checkpoint': str, 'stdin': None, 'stats': str, 
+                        'validate': None, 'no-output': None, 'memo': 1, 'layout': LAYOUT_FORMATS, 'changed': str}
+OPTIONAL_VALUE_OPTIONS = ('memo', 'changed')
+
+def parse_command_line(args):
+    '''
+    Separates the options out from the counter and filename arguments, e.g. "--processes=4" --> {'processes': '4'}, 
+    and returns both. Raises on any option not in COMMAND_LINE_OPTIONS or passed a value it does not take, so a 
+    mistyped flag stops the run before any file is touched instead of being ignored.
+    '''
+
+    options = dict(arg[2:].partition('=')[::2] for arg in args if arg.startswith('--'))
+    arguments = [arg for arg in args if not arg.startswith('--')]
+
+    for option, value in options.items():
+        if option not in COMMAND_LINE_OPTIONS:
+            raise Exception(f"Unknown option '--{option}'. The options are: " 
+                            + ', '.join('--' + known_option for known_option in COMMAND_LINE_OPTIONS) + '.')
+        allowed = COMMAND_LINE_OPTIONS[option]
+        if allowed is None:
+            if value:
+                raise Exception(f"Option '--{option}' takes no value, but was passed '{value}'.")
+            continue
+        if not value:
+            if option in OPTIONAL_VALUE_OPTIONS:
+                continue
+            raise Exception(f"Option '--{option}' needs a value, e.g. '--{option}=...'.")
+
+        if isinstance(allowed, tuple) and value not in allowed:
+            raise Exception(f"Option '--{option}' must be one of {', '.join(allowed)}, not '{value}'.")
+        elif type(allowed) in (int, float):
+            try:
+                number = type(allowed)(value)
+            except ValueError:
+                number = None
+            if number is None or number < allowed:
+                kind = 'a whole number' if type(allowed) is int else 'a number'
+                raise Exception(f"Option '--{option}' must be {kind} of at least {allowed}, not '{value}'.")
+
+    return options, arguments
+
+
+
 
 # __MAIN__ GUARD
 if __name__ == '__main__':
@@ -519,31 +2907,159 @@ if __name__ == '__main__':
     N.B.: If you DO NOT want to increment field names, you may pass in "0" instead of any other positive integer. 
     Passing "0" as the first argument to the script is the only way not to increment field names. So be sure to use an 
     integer other than "0" (or nothing at all) if you wish to use the default incrementing process.
+
+    A build that starts one process per copybook should run "python -m Pl1toCobolConverter ..." with this script's 
+    directory on PYTHONPATH rather than running the script by path, since a module's compiled bytecode is cached 
+    between runs and a script's is not. Piping all of the filenames to one process with "--stdin" is cheaper still.
+
+    Options begin with "--" and may be passed anywhere among the other arguments:
+        --stream        Pass each line through every stage and write it incrementally instead of building the whole 
+                        file in memory at each step (see complete_pipeline()).
+        --parallel      Convert the files across a process pool, with byte-identical output to the sequential run 
+                        (see parallel_batch_pipeline()).
+        --processes=N   Number of worker processes for "--parallel" (defaults to the number of cores).
+        --fsync         Flush each .cbl file to disk before it replaces the existing one (see write_output_to_file()).
+        --cache-dir=D   Reuse the stored output of copybooks that have not changed since the last run from directory D.
+        --cache-size=M  Evict the least recently used cache entries beyond M megabytes after the run (default 1024).
+        --clear-cache   Empty the cache directory before converting anything.
+        --parser=P      Either "heuristic" (default) or "structured" (see convert_pl1_lines()).
+        --watch=D       Convert every copybook in directory D, then keep reconverting the ones that change, each 
+                        within its own counter range (see watch_pipeline()). No filenames are passed with it.
+        --watch-glob=G  Which files in the watched directory are copybooks (default "*.pli").
+        --interval=S    Seconds between checks when inotify is unavailable and the directory is polled (default 1).
+        --mmap          Read each copybook through a memory map, decoding only the first 72 columns of every line 
+                        (see read_open_pl1_and_cobol_files()).
+        --serve=A       Run as a conversion service on "HOST:PORT" or "unix:PATH" instead of converting files, each 
+                        request getting the next counter range (see serve_pipeline()). No filenames are passed with 
+                        it, and "--processes=N" sets the size of its worker pool.
+        --concurrency=N Conversions the service runs at once (defaults to the number of worker processes).
+        --queue-size=N  Requests the service holds waiting before it stops reading more (defaults to 2 * concurrency).
+        --manifest=F    Convert the copybooks listed in file F, one per line, recording each one's status, counter 
+                        range and output hash in a checkpoint that a rerun resumes from. Failed files are reported at 
+                        the end instead of stopping the run (see manifest_batch_pipeline()).
+        --checkpoint=F  Where "--manifest" keeps its checkpoint (defaults to the manifest's name + ".checkpoint.json").
+                        Each file's entry is journaled to F + ".journal" as it finishes, and folded into F at the end.
+        --stdin         Also convert the filenames piped in on stdin, one per line, after any passed as arguments, so a 
+                        build can convert all of its copybooks in one process instead of starting one per file.
+        --stats=D       Write each file's per-stage timings and counters to directory D as JSON, along with their 
+                        totals over the whole batch in "batch.stats.json" (see PipelineStats).
+        --validate      Check every file in one pass instead of stopping at the first error, writing each problem 
+                        found to stdout as a line of JSON and a summary to stderr (see validate_pipeline()). Files 
+                        with errors are not written.
+        --no-output     With "--validate", write no files at all, only check them.
+        --memo[=N]      Convert each group repeated across the batch only once, keeping up to N groups (default 4096) 
+                        and reporting the hit rate at the end (see GroupMemo). Not used by "--parallel" or "--serve".
+        --layout=F      Also write the offset and storage length of every field next to each .cbl file, as "json" or 
+                        the compact "bin" format (see LayoutWriter).
+        --changed[=F]   Only rewrite the .cbl files whose output changed, leaving the others and their modification 
+                        times untouched, and report how many were changed, new and unchanged. With F, the lists of 
+                        each are also written to file F as JSON (see summarize_changes()). Not used by "--validate".
     '''
 
-    # Script requires at least one filename parameter to run:
-    if len(sys.argv) <= 1:
+    # Options are separated out from the counter and filename arguments, and checked before anything else is done:
+    options, arguments = parse_command_line(sys.argv[1:])
+    stream, fsync, mapped = 'stream' in options, 'fsync' in options, 'mmap' in options
+    cache_dir = options.get('cache-dir') or None
+    parser = options.get('parser') or 'heuristic'
+    stats_dir = options.get('stats') or None
+    memo = GroupMemo(int(options.get('memo') or 4096)) if 'memo' in options else None
+    layout = options.get('layout') or None
+    changes = {} if 'changed' in options else None
+    processes = int(options['processes']) if options.get('processes') else None
+
+    # The options every way of converting files takes, passed to each by keyword:
+    conversion_options = {'stream': stream, 'fsync': fsync, 'cache_dir': cache_dir, 'parser': parser, 
+                          'stats_dir': stats_dir, 'mapped': mapped, 'layout': layout, 'changes': changes}
+    if cache_dir and 'clear-cache' in options:
+        prune_cache(cache_dir, 0)
+
+    # Script requires at least one filename parameter to run, unless it is reading them from stdin or not converting 
+    # files one by one at all:
+    if len(arguments) == 0 and 'stdin' not in options and not any(options.get(option) for option in 
+                                                                   ('watch', 'serve', 'manifest')):
         raise Exception('At least one filename must be passed as a parameter.')
 
     try:
         # If an int is passed as the first argument to the script, begin counter on that int ...
-        counter_start = int(sys.argv[1])
-        list_of_pl1_filenames = sys.argv[2:]
+        counter_start = int(arguments[0])
+        list_of_pl1_filenames = arguments[1:]
     except:
         # ... otherwise start the counter at 1 by default.
         counter_start = 1
-        list_of_pl1_filenames = sys.argv[1:]
+        list_of_pl1_filenames = arguments[:]
+
+    # Filenames piped in are converted just as if they had been passed in order after the others:
+    if 'stdin' in options:
+        list_of_pl1_filenames += [line.strip() for line in sys.stdin if line.strip()]
+
+    # Converts copybooks sent to the service until interrupted:
+    if options.get('serve'):
+        serve_pipeline(options['serve'], counter_start, parser=parser, processes=processes, 
+                       concurrency=int(options.get('concurrency') or 0), queue_size=int(options.get('queue-size') or 0))
+
+    # Converts the copybooks of a manifest, resuming from its checkpoint:
+    elif options.get('manifest'):
+        counter_end, converted, failures = manifest_batch_pipeline(
+            options['manifest'], counter_start, checkpoint_filename=options.get('checkpoint') or None, memo=memo, 
+            **conversion_options)
+        if stats_dir and converted:
+            write_batch_stats(stats_dir, [generate_cbl_filename(pl1_filename) for pl1_filename in converted])
+
+    # Keeps the copybooks of a directory converted until interrupted:
+    elif options.get('watch'):
+        watch_pipeline(options['watch'], counter_start, pattern=options.get('watch-glob') or '*.pli', 
+                       interval=float(options.get('interval') or 1), memo=memo, **conversion_options)
+
+    # Checks every file, reporting each problem found instead of stopping at the first:
+    elif 'validate' in options:
+        counter_end, errors, warnings = validate_pipeline(list_of_pl1_filenames, counter_start, sink=sys.stdout, 
+                                                          write_output='no-output' not in options, parser=parser, 
+                                                          mapped=mapped, memo=memo)
+        print(f'{len(list_of_pl1_filenames)} files validated: {errors} errors and {warnings} warnings found.', 
+              file=sys.stderr)
+
+    # Converts every file across the process pool, then reports where the next count should begin:
+    elif 'parallel' in options:
+        list_of_cbl_filenames = [generate_cbl_filename(pl1_filename) for pl1_filename in list_of_pl1_filenames]
+        counter_end = parallel_batch_pipeline(list_of_pl1_filenames, list_of_cbl_filenames, counter_start, 
+                                              processes=processes, **conversion_options)
+        if counter_end:
+            print('All ' + str(len(list_of_pl1_filenames)) + ' files converted. The next count should begin on ' 
+            + str(counter_end))
 
     # Loops through pl1 file names, converts them to .cbl extension, and then calls complete_pipeline() to process:
-    for pl1_filename in list_of_pl1_filenames:
-
-        # Remove extensions and append .cbl
-        if (search := re.search('\.\w{2,4}$', pl1_filename)):
-            match_length = search.span()[1] - search.span()[0]
-            cbl_filename = pl1_filename[:-match_length] + '.cbl'
+    else:
+        for pl1_filename in list_of_pl1_filenames:
+            cbl_filename = generate_cbl_filename(pl1_filename)
 
             # Run entire pipeline of functions in order to process each file:
-            counter_start = complete_pipeline(pl1_filename, cbl_filename, counter_start)
-        
-        else:
-            raise Exception(f'{pl1_filename} was not in proper format. The filename needs to have an extension.')
\ No newline at end of file
+            counter_start = complete_pipeline(pl1_filename, cbl_filename, counter_start, memo=memo, 
+                                              **conversion_options)
+
+    # Totals the stats of every file in the batch:
+    if stats_dir and list_of_pl1_filenames and 'validate' not in options:
+        write_batch_stats(stats_dir, [generate_cbl_filename(pl1_filename) for pl1_filename in list_of_pl1_filenames])
+
+    # Reports how much of the batch the memo saved converting:
+    if memo is not None and memo.hits + memo.misses:
+        memo_stats = memo.to_dict()
+        print(f"Group memo: {memo_stats['memo_hits']} hits and {memo_stats['memo_misses']} misses "
+              f"({memo_stats['memo_hit_rate']:.1%}), {memo_stats['memo_lines_reused']} lines reused, "
+              f"{memo_stats['memo_entries']} groups kept.", file=sys.stderr if 'validate' in options else sys.stdout)
+
+    # Reports which outputs changed, for a downstream build to rebuild only those:
+    if changes:
+        change_summary = summarize_changes(changes)
+        print(f"{len(change_summary['changed'])} changed, {len(change_summary['new'])} new and "
+              f"{len(change_summary['unchanged'])} unchanged .cbl files.")
+        if options.get('changed'):
+            write_json(change_summary, options['changed'])
+
+    # Keep the cache within its size bound:
+    if cache_dir:
+        prune_cache(cache_dir, int(options.get('cache-size') or 1024) * 1024 * 1024)
+
+    # A manifest run that left any file unconverted fails, as does a validation that found errors, once everything 
+    # else is done:
+    if (options.get('manifest') and failures) or ('validate' in options and errors):
+        sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,360 @@
+import os
+import re
+import sys
+import json
+import time
+import random
+import timeit
+import platform
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+
+try:
+    import resource
+except ImportError: # not available on Windows, where peak RSS is reported as None
+    resource = None
+
+from Pl1toCobolConverter import (PATTERNS, complete_pipeline, remove_comments_and_add_header,
+                                 general_formatting, replace_pl1_expressions_and_add_periods,
+                                 clean_up_formatting_and_increment_field_names, write_output_to_file)
+
+
+DEFAULT_TYPE_MIX = {'CHAR': 4, 'FIXED': 3, 'FIXED BIN': 2, 'PIC': 1}
+DEFAULT_SIZES = [1000, 100000, 1000000]
+STARTUP_TARGET_MS = 30 # most a one-copybook "python -m Pl1toCobolConverter" run may take beyond a bare interpreter
+
+
+# SYNTHETIC COPYBOOK GENERATOR
+def generate_copybook(number_of_lines, seed=0, max_depth=9, type_mix=None, comment_density=0.05,
+                      continuation_rate=0.05, occurs_rate=0.05):
+    '''
+    Yields the lines of a seeded, reproducible Pl1 copybook of roughly 'number_of_lines' lines, one at a time so even 
+    the largest copybooks are never held in memory:
+        - 'max_depth' is the deepest level number used (up to 9, the deepest add_left_formatting() indents),
+        - 'type_mix' weighs how often each of CHAR, FIXED, FIXED BIN and PIC is declared,
+        - 'comment_density' is the share of lines carrying a comment, either trailing or on a line of their own,
+        - 'continuation_rate' is the share of fields whose data type continues on the next line,
+        - 'occurs_rate' is the share of groups that are dimensioned arrays (OCCURS).
+    Every generated copybook converts cleanly with both the heuristic and the structured parser.
+    '''
+
+    rng = random.Random(seed)
+    type_mix = type_mix or DEFAULT_TYPE_MIX
+    data_types, weights = list(type_mix), list(type_mix.values())
+    max_depth = min(max(max_depth, 2), 9)
+
+    def data_type_attribute(data_type):
+        if data_type == 'CHAR':
+            return f'CHAR({rng.randint(1, 80)})'
+        elif data_type == 'FIXED':
+            precision = rng.randint(1, 15)
+            return f'FIXED({precision},{rng.randint(0, precision - 1)})' if precision > 1 else 'FIXED(1)'
+        elif data_type == 'FIXED BIN':
+            return f'FIXED BIN({rng.choice([15, 31, 63])})'
+        return f"PIC '({rng.randint(1, 9)})9'"
+
+    def add_comment(line):
+        return line.ljust(48) + f'/* NOTE {rng.randint(0, 9999)} */' if rng.random() < comment_density else line
+
+    yield '/****************************************************/\n'
+    yield f'/* SYNTHETIC COPYBOOK, SEED {seed:<24} */\n'
+    yield '/****************************************************/\n'
+    yield ' DCL 1 SYNTHETIC_REC,\n'
+    level, field_number, lines_generated = 2, 0, 4
+    while lines_generated < number_of_lines - 1:
+        indent = ' ' * (2 * level + 3)
+        name = f'FIELD_{field_number}'
+        field_number += 1
+
+        if rng.random() < comment_density / 2:
+            yield indent + f'/* SECTION {field_number} */\n'
+            lines_generated += 1
+
+        # GROUPS (OPTIONALLY DIMENSIONED), WHICH THE NEXT FIELD IS ALWAYS NESTED UNDER
+        if level < max_depth and rng.random() < 0.2:
+            dimension = f'({rng.randint(2, 20)})' if rng.random() < occurs_rate else ''
+            yield add_comment(f'{indent}{level} {name}{dimension},') + '\n'
+            lines_generated += 1
+            level += 1
+            continue
+
+        # ELEMENTARY FIELDS, WITH THE DATA TYPE OPTIONALLY CONTINUING ON THE NEXT LINE
+        attribute = data_type_attribute(rng.choices(data_types, weights)[0])
+        if rng.random() < continuation_rate:
+            yield f'{indent}{level} {name}\n'
+            yield add_comment(' ' * 30 + attribute + ',') + '\n'
+            lines_generated += 2
+        else:
+            yield add_comment(f'{indent}{level} {name:<20} {attribute},') + '\n'
+            lines_generated += 1
+        level = rng.randint(2, level) if rng.random() < 0.3 else level
+
+    yield ' ' * (2 * level + 3) + f'{level} {"LAST_FIELD":<20} CHAR(1);\n'
+
+
+
+# PIPELINE BENCHMARKS
+def peak_rss_kb():
+    '''
+    Peak resident set size of the current process in kilobytes, or None where it cannot be measured. On Linux it is 
+    read from /proc, since getrusage() also counts the peak of the parent a process was forked from.
+    '''
+
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss # macOS reports bytes, Linux kilobytes
+
+
+def run_case(pl1_filepath, mode):
+    '''
+    Converts one generated copybook in the current process and returns its measurements. In 'list' mode each of
+    the five stages of complete_pipeline() is timed on its own, along with the lines going in and out of it. The
+    'stream' and 'structured' modes run the whole conversion through complete_pipeline() and are timed end to end.
+    '''
+
+    cbl_filepath = os.path.splitext(pl1_filepath)[0] + '.cbl'
+    with open(pl1_filepath, 'r') as f:
+        lines_in = sum(1 for line in f)
+
+    stages = {}
+    start = time.perf_counter()
+    if mode == 'list':
+        def timed(stage_name, function, *args):
+            stage_start = time.perf_counter()
+            output = function(*args)
+            output_lines = output[0] if isinstance(output, tuple) else output
+            stages[stage_name] = {'seconds': time.perf_counter() - stage_start,
+                                  'lines_out': len(output_lines) if isinstance(output_lines, list) else None}
+            return output
+
+        with open(pl1_filepath, 'r') as f:
+            pl1_text = f.readlines()
+        new_pl1_text_1 = timed('remove_comments_and_add_header', remove_comments_and_add_header, pl1_text)
+        new_pl1_text_2 = timed('general_formatting', general_formatting, new_pl1_text_1)
+        new_pl1_text_3 = timed('replace_pl1_expressions_and_add_periods', replace_pl1_expressions_and_add_periods,
+                               new_pl1_text_2, pl1_filepath)
+        new_pl1_text_4, counter_end = timed('clean_up_formatting_and_increment_field_names',
+                                            clean_up_formatting_and_increment_field_names, new_pl1_text_3, 1)
+        final_output = timed('write_output_to_file', write_output_to_file, new_pl1_text_4, cbl_filepath)
+        stages['write_output_to_file']['lines_out'] = final_output.count('\n')
+
+    else:
+        parser = 'structured' if mode == 'structured' else 'heuristic'
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                complete_pipeline(pl1_filepath, cbl_filepath, 1, stream=True, parser=parser)
+            finally:
+                sys.stdout = stdout
+    seconds = time.perf_counter() - start
+
+    with open(cbl_filepath, 'r') as f:
+        lines_out = sum(1 for line in f)
+
+    return {'mode': mode, 'lines_in': lines_in, 'lines_out': lines_out, 'seconds': seconds,
+            'lines_per_second': lines_in / seconds if seconds else None, 'peak_rss_kb': peak_rss_kb(),
+            'stages': stages}
+
+
+def bench_pipeline(sizes=DEFAULT_SIZES, modes=('list', 'stream', 'structured'), seed=0, **generator_options):
+    '''
+    Generates a copybook of each size and converts it once per mode, every case in a fresh process so its peak RSS is
+    its own. Returns the machine-readable report.
+    '''
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            pl1_filepath = os.path.join(temp_dir, f'SYNTH{size}.pli')
+            with open(pl1_filepath, 'w') as f:
+                f.writelines(generate_copybook(size, seed, **generator_options))
+
+            for mode in modes:
+                with context.Pool(1) as pool:
+                    result = pool.apply(run_case, (pl1_filepath, mode))
+                result['size'] = size
+                results.append(result)
+
+    return {'benchmark': 'pipeline', 'seed': seed, 'generator_options': generator_options,
+            'python': platform.python_version(), 'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+
+
+
+# STARTUP BENCHMARK: WHAT A BUILD PAYS PER COPYBOOK WHEN IT STARTS ONE PROCESS EACH
+def bench_startup(runs=20, batch_size=100):
+    '''
+    Times, as the median of 'runs' fresh processes, a bare interpreter, importing the converter, and converting one
+    small copybook both as a script and as a module, whose bytecode is cached unlike a script's. Then converts
+    'batch_size' copybooks in one process through "--stdin" and reports the time per copybook. The report says
+    whether the module run stays within STARTUP_TARGET_MS of the bare interpreter.
+    '''
+
+    converter_dir = os.path.dirname(os.path.abspath(__file__))
+    script = os.path.join(converter_dir, 'Pl1toCobolConverter.py')
+
+    def median_ms(command, cwd, env, stdin_text=None):
+        timings = []
+        for run in range(runs):
+            start = time.perf_counter()
+            subprocess.run(command, cwd=cwd, env=env, input=stdin_text, text=True, stdout=subprocess.DEVNULL,
+                           check=True)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        copybook = ''.join(generate_copybook(20))
+        pl1_filenames = [f'COPY{i}.pli' for i in range(batch_size)]
+        for pl1_filename in pl1_filenames:
+            with open(os.path.join(temp_dir, pl1_filename), 'w') as f:
+                f.write(copybook)
+
+        # Bytecode is cached under the temporary directory, and always written even if the caller disabled it:
+        env = dict(os.environ, PYTHONPATH=converter_dir, PYTHONPYCACHEPREFIX=os.path.join(temp_dir, 'pycache'))
+        env.pop('PYTHONDONTWRITEBYTECODE', None)
+        subprocess.run([sys.executable, '-c', 'import Pl1toCobolConverter'], env=env, check=True)
+
+        results = {
+            'interpreter_ms': median_ms([sys.executable, '-c', 'pass'], temp_dir, env),
+            'import_ms': median_ms([sys.executable, '-c', 'import Pl1toCobolConverter'], temp_dir, env),
+            'script_one_file_ms': median_ms([sys.executable, script, '1', 'COPY0.pli'], temp_dir, env),
+            'module_one_file_ms': median_ms([sys.executable, '-m', 'Pl1toCobolConverter', '1', 'COPY0.pli'],
+                                            temp_dir, env),
+        }
+        stdin_batch_ms = median_ms([sys.executable, '-m', 'Pl1toCobolConverter', '1', '--stdin'], temp_dir, env,
+                                   '\n'.join(pl1_filenames) + '\n')
+        results['stdin_per_file_ms'] = stdin_batch_ms / batch_size
+
+    overhead_ms = results['module_one_file_ms'] - results['interpreter_ms']
+
+    return {'benchmark': 'startup', 'runs': runs, 'batch_size': batch_size, 'results': results,
+            'module_overhead_ms': overhead_ms, 'target_ms': STARTUP_TARGET_MS,
+            'target_met': overhead_ms <= STARTUP_TARGET_MS, 'python': platform.python_version(),
+            'platform': platform.platform(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+
+
+# PATTERN REGISTRY: PER-LINE COST BEFORE AND AFTER
+def legacy_level_number(line):
+    '''The nine-way elif chain add_left_formatting() used before the shared pattern registry.'''
+
+    for number_id in range(1, 10):
+        if re.search('^\\s+' + str(number_id), line):
+            return number_id
+    return None
+
+
+def registry_level_number(line):
+    '''The single-capture lookup add_left_formatting() uses now.'''
+
+    if (search_result := PATTERNS['level_number'].match(line)):
+        return int(search_result.group(1))
+    return None
+
+
+def time_per_line(function, lines, repeat=5):
+    '''Returns the best per-line cost of a function over the sample lines, in nanoseconds.'''
+
+    best = min(timeit.repeat(lambda: [function(line) for line in lines], number=1, repeat=repeat))
+    return best / len(lines) * 1e9
+
+
+def bench_patterns(lines):
+    '''
+    Compares each registry pattern against the equivalent module-level string-pattern call that goes through the
+    're' cache on every line, then compares the level-number lookup and the whole general_formatting() stage.
+    '''
+
+    results = {}
+    for name, pattern in PATTERNS.compile_all().items():
+        before = time_per_line(lambda line: re.search(pattern.pattern, line), lines)
+        after = time_per_line(pattern.search, lines)
+        results[name] = (before, after)
+
+    results['add_left_formatting (level number)'] = (
+        time_per_line(legacy_level_number, lines),
+        time_per_line(registry_level_number, lines),
+    )
+    stage = time_per_line(lambda line: general_formatting([line]), lines)
+    results['general_formatting (whole stage)'] = (None, stage)
+
+    return results
+
+
+
+# __MAIN__ GUARD
+if __name__ == '__main__':
+    '''
+    Run as "benchmark.py pipeline [options]", "benchmark.py startup [options]" or "benchmark.py patterns
+    [number_of_lines]".
+
+    "pipeline" converts a synthetic copybook of each size in every mode and writes a JSON report of lines per second,
+    peak RSS and the time and lines in/out of each stage, to compare runs over time. Options:
+        --sizes=1000,100000,1000000     Copybook sizes in lines.
+        --modes=list,stream,structured  Conversion modes to run (see run_case()).
+        --seed=0                        Seed of the copybook generator.
+        --max-depth=9, --comment-density=0.05, --continuation-rate=0.05, --occurs-rate=0.05
+                                        Shape of the generated copybooks (see generate_copybook()).
+        --json=FILE                     Write the report to FILE instead of printing it.
+
+    "startup" reports the per-process cost of converting one copybook at a time against the STARTUP_TARGET_MS target,
+    and the per-copybook cost of piping them all to one process instead (see bench_startup()). Options:
+        --runs=20                       Processes started to time each case.
+        --batch-size=100                Copybooks converted by the single "--stdin" process.
+        --json=FILE                     Write the report to FILE instead of printing it.
+
+    "patterns" prints the per-line cost in nanoseconds of each pattern before (string pattern looked up through the
+    're' cache) and after (precompiled in the shared PATTERNS registry).
+    '''
+
+    options = dict(arg[2:].partition('=')[::2] for arg in sys.argv[1:] if arg.startswith('--'))
+    arguments = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    command = arguments[0] if arguments else 'pipeline'
+
+    if command == 'patterns':
+        number_of_lines = int(arguments[1]) if len(arguments) > 1 else 1000
+        lines = list(generate_copybook(number_of_lines))
+        print(f'{"pattern":<40}{"before ns/line":>16}{"after ns/line":>16}{"speedup":>10}')
+        for name, (before, after) in bench_patterns(lines).items():
+            before_str = f'{before:16.0f}' if before is not None else ' ' * 15 + '-'
+            speedup_str = f'{before / after:9.2f}x' if before is not None else ' ' * 9 + '-'
+            print(f'{name:<40}{before_str}{after:16.0f}{speedup_str}')
+
+    elif command == 'pipeline':
+        sizes = [int(size) for size in options['sizes'].split(',')] if options.get('sizes') else DEFAULT_SIZES
+        modes = options['modes'].split(',') if options.get('modes') else ['list', 'stream', 'structured']
+        generator_options = {option.replace('-', '_'): (int if option == 'max-depth' else float)(options[option])
+                             for option in ('max-depth', 'comment-density', 'continuation-rate', 'occurs-rate')
+                             if options.get(option)}
+        report = bench_pipeline(sizes, modes, int(options.get('seed') or 0), **generator_options)
+        report_str = json.dumps(report, indent=2)
+        if options.get('json'):
+            with open(options['json'], 'w') as f:
+                f.write(report_str + '\n')
+        else:
+            print(report_str)
+
+    elif command == 'startup':
+        report = bench_startup(int(options.get('runs') or 20), int(options.get('batch-size') or 100))
+        report_str = json.dumps(report, indent=2)
+        if options.get('json'):
+            with open(options['json'], 'w') as f:
+                f.write(report_str + '\n')
+        else:
+            print(report_str)
+
+    else:
+        raise Exception(f"Unknown benchmark '{command}'. Use either 'pipeline', 'startup' or 'patterns'.")
@@ -0,0 +1,282 @@
+'''
+Regression tests: each optional path through the converter must give exactly the output of the plain one, over the
+seeded synthetic copybooks of benchmark.py. Run with "python -m pytest tests".
+'''
+
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Pl1toCobolConverter
+from Pl1toCobolConverter import (DeclarationError, GroupMemo, LayoutWriter, ValidationReport, complete_pipeline,
+                                 convert_pl1_lines, convert_text, generate_cbl_filename, layout_path,
+                                 manifest_batch_pipeline, parallel_batch_pipeline, parse_declarations,
+                                 remove_comments_and_add_header, tokenize_pl1)
+from benchmark import generate_copybook
+
+
+SEEDS = range(8)
+PARSERS = ('heuristic', 'structured')
+
+
+def copybook(seed, number_of_lines=400):
+    return list(generate_copybook(number_of_lines, seed=seed, occurs_rate=0.2, continuation_rate=0.1))
+
+
+def read_bytes(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def read_layout(cbl_filename, layout_format='json'):
+    return read_bytes(layout_path(cbl_filename, layout_format))
+
+
+# MEMO: A GROUP REUSED FROM THE MEMO MUST GIVE THE SAME LINES AS CONVERTING IT AGAIN
+@pytest.mark.parametrize('seed', SEEDS)
+def test_memo_matches_plain_conversion(seed):
+    pl1_lines = copybook(seed)
+    expected = convert_text(pl1_lines, 7)
+
+    # A tiny memo evicts and re-stores constantly, and a shared one reuses groups across repeated copybooks:
+    tiny_memo, shared_memo = GroupMemo(max_entries=8, max_group_lines=2), GroupMemo()
+    for memo in (tiny_memo, shared_memo, shared_memo):
+        assert convert_text(pl1_lines, 7, memo=memo) == expected
+    assert shared_memo.hits > 0
+
+
+# STREAM: CHAINING THE STAGES AS GENERATORS MUST GIVE THE SAME LINES AS BUILDING EACH LIST
+@pytest.mark.parametrize('parser', PARSERS)
+@pytest.mark.parametrize('seed', SEEDS)
+def test_stream_matches_list(seed, parser):
+    pl1_lines = copybook(seed)
+    cobol_lines, counter_end = convert_pl1_lines(pl1_lines, 7, parser=parser)
+
+    cobol_text, counter_state = convert_pl1_lines(iter(pl1_lines), 7, stream=True, parser=parser)
+    assert list(cobol_text) == cobol_lines
+    assert counter_state['counter_end'] == counter_end
+
+
+# PARALLEL: PRE-ASSIGNED COUNTER RANGES MUST GIVE THE SAME FILES AS THREADING THE COUNTER SEQUENTIALLY
+@pytest.mark.parametrize('parser', PARSERS)
+def test_parallel_matches_sequential(parser, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pl1_filenames = []
+    for seed in SEEDS:
+        pl1_filename = f'SYNTHETIC{seed}.pli'
+        with open(pl1_filename, 'w') as f:
+            f.writelines(copybook(seed, 200))
+        pl1_filenames.append(pl1_filename)
+    cbl_filenames = [generate_cbl_filename(pl1_filename) for pl1_filename in pl1_filenames]
+
+    counter_start = 5
+    for pl1_filename, cbl_filename in zip(pl1_filenames, cbl_filenames):
+        counter_start = complete_pipeline(pl1_filename, cbl_filename, counter_start, parser=parser, layout='bin')
+    sequential = {cbl_filename: (read_bytes(cbl_filename), read_layout(cbl_filename, 'bin'))
+                  for cbl_filename in cbl_filenames}
+    for cbl_filename in cbl_filenames:
+        os.remove(cbl_filename)
+
+    counter_end = parallel_batch_pipeline(pl1_filenames, cbl_filenames, 5, processes=2, parser=parser, layout='bin')
+    assert counter_end == counter_start
+    for cbl_filename in cbl_filenames:
+        assert (read_bytes(cbl_filename), read_layout(cbl_filename, 'bin')) == sequential[cbl_filename]
+
+
+# COMMENTS: EVERY COMMENT IS BLANKED WITH SPACES, AND ONLY THE COMMENTS
+def remove_comments(pl1_lines):
+    return remove_comments_and_add_header([' DCL 1 REC,\n'] + pl1_lines)[1:]
+
+
+def test_several_comments_on_one_line():
+    assert remove_comments(['   2 A /* one */ CHAR(1), /* two */ /*three*/\n']) == \
+        ['   2 A           CHAR(1),                    \n']
+
+
+def test_comment_over_several_lines():
+    assert remove_comments(['   2 A CHAR(1), /* opens\n', '   and goes on\n', '   and ends */ 2 B CHAR(2);\n']) == \
+        ['   2 A CHAR(1),         \n', '              \n', '               2 B CHAR(2);\n']
+
+
+def test_unterminated_comment_blanks_the_rest_of_the_file():
+    assert remove_comments(['   2 A CHAR(1); /* never closed\n', '   2 B CHAR(2);\n', '   2 C CHAR(3);']) == \
+        ['   2 A CHAR(1);                \n', '               \n', '               ']
+
+
+def test_comments_keep_the_columns_of_the_text():
+    pl1_lines = ['   2 A /**/ CHAR(1), /* x */\n', '/* a */   2 B /* b\n', ' c */ CHAR(2);\n']
+    for line, new_line in zip(pl1_lines, remove_comments(pl1_lines)):
+        assert len(new_line) == len(line)
+        assert all(new_character in (character, ' ') for character, new_character in zip(line, new_line))
+    assert [line.find('CHAR') for line in remove_comments(pl1_lines)] == [12, -1, 6]
+    assert remove_comments(pl1_lines)[1].index('2 B') == 10
+
+
+# FINAL FORMATTING: A DIMENSION LEFT ON A NUMBERED NAME IS MOVED OUT ONTO AN OCCURS LINE OF ITS OWN
+@pytest.mark.parametrize('counter_start, expected', [
+    (7, ['       01 REC-7.', '         02 ITEMS-8       PIC X(4)', '                      OCCURS 3 TIMES.',
+         '         02 DONE-9', '                      OCCURS 12 TIMES.', '           03 FLAG-10  PIC X(1).']),
+    (0, ['       01 REC.', '         02 ITEMS(3) PIC X(4).', '         02 DONE(12).', '           03 FLAG PIC X(1).']),
+])
+def test_hidden_occurs(counter_start, expected):
+    pl1_lines = [' DCL 1 REC,\n', '   2 ITEMS(3)  CHAR(4),\n', '   2 DONE(12),\n', '     3 FLAG  CHAR(1);\n']
+    cobol_lines, counter_end = convert_pl1_lines(pl1_lines, counter_start)
+    assert [line.rstrip() for line in cobol_lines] == expected
+    assert all(len(line) == 72 for line in cobol_lines)
+    assert counter_end == (11 if counter_start else 0)
+
+
+# STRUCTURED PARSING: TOKENS AND DECLARATIONS AS DECLARED, AND EACH MALFORMED ENTRY NAMED BY ITS RULE AND LINE
+def parse(pl1_lines, report=None):
+    return list(parse_declarations(tokenize_pl1([' DCL 1 REC,\n'] + pl1_lines), report=report))
+
+
+def test_tokens_keep_strings_whole():
+    tokens = list(tokenize_pl1([" DCL 1 REC, /* a; comment */\n", "   2 A CHAR(8) INIT('IT''S; A, B');\n"]))
+    assert tokens == [('name', 'DCL', 1), ('number', '1', 1), ('name', 'REC', 1), ('punct', ',', 1),
+                      ('number', '2', 2), ('name', 'A', 2), ('name', 'CHAR', 2), ('punct', '(', 2),
+                      ('number', '8', 2), ('punct', ')', 2), ('name', 'INIT', 2), ('punct', '(', 2),
+                      ('string', "'IT''S; A, B'", 2), ('punct', ')', 2), ('punct', ';', 2)]
+
+
+def test_fixed_decimal_and_binary():
+    record, fixed_dec, dec_fixed, bin_fixed, fixed_binary, fixed = parse(
+        ['   2 A FIXED DEC(7,2),\n', '   2 B DEC FIXED(5),\n', '   2 C BIN FIXED(31),\n',
+         '   2 D FIXED BINARY,\n', '   2 E FIXED;\n'])
+    assert (record.data_type, fixed_dec.parent) == (None, record)
+    assert (fixed_dec.data_type, fixed_dec.precision, fixed_dec.scale) == ('FIXED', 7, 2)
+    assert (dec_fixed.data_type, dec_fixed.precision, dec_fixed.scale) == ('FIXED', 5, 0)
+    assert (bin_fixed.data_type, bin_fixed.precision) == ('FIXED BIN', 31)
+    assert (fixed_binary.data_type, fixed_binary.precision) == ('FIXED BIN', 15)
+    assert (fixed.data_type, fixed.precision, fixed.scale) == ('FIXED', 5, 0)
+
+
+def test_dimensions_init_and_pictures():
+    record, bounded, counted, picture = parse(["   2 A(0:9) CHAR(4) INIT(''),\n", '   2 B(3) FIXED DEC(3),\n',
+                                               "   2 C PIC '(3)9''X'' ';\n"])
+    assert (bounded.dimension, bounded.data_type, bounded.precision, bounded.attributes) == (10, 'CHAR', 4, ('INIT',))
+    assert (counted.dimension, counted.data_type) == (3, 'FIXED')
+    assert (picture.data_type, picture.picture, picture.line_number) == ('PIC', "(3)9'X' ", 4)
+
+
+@pytest.mark.parametrize('pl1_line, rule', [('   2 F BIT(8),', 'unsupported_attribute'),
+                                            ('   2 F CHAR(8) VARYING,', 'unsupported_attribute'),
+                                            ('   2 F(2,3) CHAR(1),', 'array_dimension'),
+                                            ('   2 F FIXED DEC(5,2,1),', 'precision_scale'),
+                                            ('   2 F BIN FIXED(X),', 'fixed_bin_width'),
+                                            ('   2 F PIC 9,', 'improper_pic'),
+                                            ('   2 F CHAR(A),', 'improper_format')])
+def test_declaration_errors_name_rule_and_line(pl1_line, rule):
+    pl1_lines = ['   2 OK CHAR(1),\n', pl1_line + '\n', '   2 NEXT CHAR(1);\n']
+    with pytest.raises(DeclarationError) as error:
+        parse(pl1_lines)
+    assert (error.value.rule, error.value.line_number) == (rule, 3)
+    assert 'Line 3 ' in str(error.value)
+
+    # With a report, the entry is recorded there and skipped, and the next one still parsed:
+    report = ValidationReport()
+    assert [declaration.name for declaration in parse(pl1_lines, report)] == ['REC', 'OK', 'NEXT']
+    assert [(diagnostic['rule'], diagnostic['source_line']) for diagnostic in report.diagnostics] == [(rule, 3)]
+
+
+# MANIFEST: A RUN STOPPED PART WAY RESUMES FROM ITS JOURNAL AND ENDS WITH THE FILES OF AN UNINTERRUPTED ONE
+def test_manifest_resumes_from_journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    pl1_filenames = []
+    for seed in range(4):
+        pl1_filename = f'SYNTHETIC{seed}.pli'
+        with open(pl1_filename, 'w') as f:
+            f.writelines(copybook(seed, 200))
+        pl1_filenames.append(pl1_filename)
+    with open('manifest.txt', 'w') as f:
+        f.write('\n'.join(pl1_filenames) + '\n')
+    cbl_filenames = [generate_cbl_filename(pl1_filename) for pl1_filename in pl1_filenames]
+
+    counter_end, converted, failures = manifest_batch_pipeline('manifest.txt', 5)
+    assert (converted, failures) == (pl1_filenames, {})
+    assert not os.path.exists('manifest.txt.checkpoint.json.journal')
+    with open('manifest.txt.checkpoint.json') as f:
+        uninterrupted = json.load(f)
+    expected = {cbl_filename: read_bytes(cbl_filename) for cbl_filename in cbl_filenames}
+    for filename in cbl_filenames + ['manifest.txt.checkpoint.json']:
+        os.remove(filename)
+
+    # Stop the run on its third file, as a kill would, after cutting the journal's last line short:
+    def interrupted_pipeline(pl1_filename, *args, **kwargs):
+        if pl1_filename == pl1_filenames[2]:
+            with open('manifest.txt.checkpoint.json.journal', 'a') as f:
+                f.write('{"file": "SYNTHETIC2.pli", "ent')
+            raise KeyboardInterrupt
+        return complete_pipeline(pl1_filename, *args, **kwargs)
+
+    monkeypatch.setattr(Pl1toCobolConverter, 'complete_pipeline', interrupted_pipeline)
+    with pytest.raises(KeyboardInterrupt):
+        manifest_batch_pipeline('manifest.txt', 5)
+    assert not os.path.exists('manifest.txt.checkpoint.json')
+    monkeypatch.setattr(Pl1toCobolConverter, 'complete_pipeline', complete_pipeline)
+
+    assert manifest_batch_pipeline('manifest.txt', 5) == (counter_end, pl1_filenames[2:], {})
+    assert not os.path.exists('manifest.txt.checkpoint.json.journal')
+    with open('manifest.txt.checkpoint.json') as f:
+        assert json.load(f) == uninterrupted
+    assert {cbl_filename: read_bytes(cbl_filename) for cbl_filename in cbl_filenames} == expected
+
+
+# LAYOUT: THE SAME STORAGE WHICHEVER PATH LAYS IT OUT, AND NEVER A SILENT ZERO-LENGTH FIELD
+@pytest.mark.parametrize('seed', SEEDS)
+def test_memo_matches_plain_layout(seed, tmp_path):
+    pl1_lines = copybook(seed)
+    cbl_filename = str(tmp_path / 'SYNTHETIC.cbl')
+
+    layouts = []
+    for memo in (None, GroupMemo(max_entries=8, max_group_lines=2), GroupMemo()):
+        for repeat in range(2):
+            with LayoutWriter(cbl_filename, 'json') as layout:
+                convert_text(pl1_lines, 7, memo=memo, layout=layout)
+            layouts.append(read_layout(cbl_filename))
+    assert all(layout == layouts[0] for layout in layouts)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_layouts_agree_across_parsers(seed, tmp_path):
+    pl1_lines = copybook(seed)
+    cbl_filename = str(tmp_path / 'SYNTHETIC.cbl')
+
+    # The heuristic path keeps Pl1 pictures as they are, so only the storage is compared:
+    layouts = {}
+    for parser in PARSERS:
+        with LayoutWriter(cbl_filename, 'json') as layout:
+            convert_text(pl1_lines, 0, parser=parser, layout=layout)
+        layouts[parser] = [{key: value for key, value in field.items() if key != 'picture'}
+                           for field in json.loads(read_layout(cbl_filename))['fields']]
+    assert layouts['heuristic'] == layouts['structured']
+
+
+def test_field_without_storage_is_not_laid_out(tmp_path):
+    pl1_lines = [' DCL 1 REC,\n', '   2 A CHAR(10),\n', '   2 B FIXED(7,2);\n']
+    cbl_filename = str(tmp_path / 'REC.cbl')
+
+    with pytest.raises(Exception, match='cannot be laid out'):
+        with LayoutWriter(cbl_filename, 'json') as layout:
+            convert_text(pl1_lines, 7, layout=layout)
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.mark.parametrize('layout_format', ('json', 'bin'))
+def test_cached_layout_names_its_own_output(layout_format, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    for pl1_filename in ('A.pli', 'B.pli'):
+        with open(pl1_filename, 'w') as f:
+            f.writelines(copybook(0, 200))
+
+    complete_pipeline('A.pli', 'A.cbl', 5, cache_dir='cache', layout=layout_format)
+    complete_pipeline('B.pli', 'B.cbl', 5, cache_dir='cache', layout=layout_format)
+    complete_pipeline('B.pli', 'C.cbl', 5, layout=layout_format)
+    assert read_bytes('B.cbl') == read_bytes('C.cbl')
+    assert read_layout('B.cbl', layout_format) == read_layout('C.cbl', layout_format).replace(b'C.cbl', b'B.cbl')
+    if layout_format == 'json':
+        assert json.loads(read_layout('B.cbl'))['file'] == 'B.cbl'